@@ -1,20 +1,25 @@
 from qiskit import *
 from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit
-from qiskit import IBMQ, Aer, execute
+from qiskit import IBMQ
 
 import numpy as np
 import matplotlib.pyplot as plt
+import warnings
 
-from utils.board_tools import kbits, compute_uncovered_tiles, board2_bitstrings
+from functools import lru_cache
+
+from utils.board_tools import beam_mask_index, compute_uncovered_tiles, board2_bitstrings
 from circuit_parts.diffusers import diffuser_gate, diffuser
+from circuit_parts.conjunctions import conjunction_oracle
+from circuit_parts.esop import beam_checker_truth_table, synthesize_esop, emit_esop
+from utils.execution import run_circuit, print_counts
 from board_qram import init_light_states
 
 from datasets.data import *
 
 
-def single_beam_check(beamstring, qc, board_qubits, output_qubit, ancilla_qubits=None):
+def uncovered_tiles_check(qubit_idx, qc, board_qubits, output_qubit, ancilla_qubits=None):
 
-    qubit_idx = compute_uncovered_tiles(beamstring)
     num_controls = len(qubit_idx)
     num_ancillas = num_controls - 2
 
@@ -26,15 +31,55 @@ def single_beam_check(beamstring, qc, board_qubits, output_qubit, ancilla_qubits
         qc.mct(control_qubits, output_qubit)
 
 
-def beam_checker(qc, board_qubits, output_qubit, ancilla_qubits=None):
+def single_beam_check(beamstring, qc, board_qubits, output_qubit, ancilla_qubits=None):
+    uncovered_tiles_check(compute_uncovered_tiles(beamstring), qc, board_qubits, output_qubit, ancilla_qubits)
+
+
+def beam_checker_num_ancillas(board_dim):
+    _, _, uncovered_tiles = beam_mask_index(board_dim)
+    return max(0, max(len(qubit_idx) for qubit_idx in uncovered_tiles) - 2)
+
+
+@lru_cache(maxsize=8)
+def beam_checker_esop(board_dim, num_ancillas):
+    # Cheapest verified ESOP of the beam_checker function, the beam
+    # combinations themselves are one of the candidate covers
+    _, _, uncovered_tiles = beam_mask_index(board_dim)
+    table = beam_checker_truth_table(board_dim, 'parity')
+    polarity, plan, _ = synthesize_esop(table, board_dim ** 2, num_ancillas, covers=[(0, uncovered_tiles)])
+
+    return polarity, plan
+
+
+def beam_checker(qc, board_qubits, output_qubit, ancilla_qubits=None, method='factored', factored=None):
+
+    # factored=True/False (also passed positionally) selects 'factored'/'mct'
+    if isinstance(method, bool):
+        method, factored = 'factored', method
+    if factored is not None:
+        warnings.warn("beam_checker(factored=...) is deprecated, use method='factored' or method='mct'",
+                      DeprecationWarning, stacklevel=2)
+        method = 'factored' if factored else 'mct'
 
     board_size = len(board_qubits)
     board_dim = int(np.sqrt(board_size))
 
-    beamstrings = kbits(2 * board_dim, board_dim - 1)
+    _, _, uncovered_tiles = beam_mask_index(board_dim)
 
-    for b in beamstrings:
-        single_beam_check(b, qc, board_qubits, output_qubit, ancilla_qubits)
+    # Shared sub-products of the uncovered tile sets are computed once
+    if method == 'factored':
+        conjunction_oracle(qc, uncovered_tiles, board_qubits, output_qubit, ancilla_qubits)
+        return
+    elif method == 'esop':
+        num_ancillas = len(ancilla_qubits) if ancilla_qubits is not None else 0
+        polarity, plan = beam_checker_esop(board_dim, num_ancillas)
+        emit_esop(qc, polarity, plan, board_qubits, output_qubit, ancilla_qubits)
+        return
+    elif method != 'mct':
+        raise ValueError(f"Unknown beam_checker method {method}, use 'factored', 'esop' or 'mct'")
+
+    for qubit_idx in uncovered_tiles:
+        uncovered_tiles_check(qubit_idx, qc, board_qubits, output_qubit, ancilla_qubits)
 
 
 def single_board_checker(board, draw=False):
@@ -58,15 +103,7 @@ def single_board_checker(board, draw=False):
         qc.draw(output='mpl')
         plt.show()
 
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend, shots=100)
-    result = job.result()
-    count = result.get_counts()
-
-    max_k = min(len(count), 10)
-
-    for k in sorted(count, key=count.get, reverse=True)[:max_k]:
-        print(f"Solution: {k}\tCounts: {count[k]}")
+    print_counts(run_circuit(qc, shots=100), max_k=10)
 
 
 if __name__ == "__main__":
@@ -1,16 +1,20 @@
 from qiskit import *
 from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit
-from qiskit import IBMQ, Aer, execute
+from qiskit import IBMQ
 
 import numpy as np
 import matplotlib.pyplot as plt
 
+from functools import lru_cache
+
 from utils.board_tools import compute_switch_edges
+from utils.lights_out_solver import solve_lights_out
 from board_qram import init_light_states
 from circuit_parts.diffusers import diffuser_gate, diffuser
+from utils.execution import run_circuit, print_counts
 
 
-def lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits=None):
+def lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits=None, mode='basic'):
 
     num_lights = len(switch_qubits)
 
@@ -25,7 +29,7 @@ def lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qub
             qc.cx(switch_qubits[source], light_qubits[target])
 
     if ancilla_qubits is not None:
-        qc.mct(light_qubits, output_qubit, ancilla_qubits, mode='basic')
+        qc.mct(light_qubits, output_qubit, ancilla_qubits, mode=mode)
     else:
         qc.mct(light_qubits, output_qubit)
 
@@ -56,6 +60,93 @@ def lights_out_oracle_gate(use_ancillas=False, num_lights=9):
     return oracle
 
 
+@lru_cache(maxsize=64)
+def lights_out_iterations_gate(num_lights, num_ancillas, num_iterations=1, mode='basic'):
+    # num_iterations oracle + diffuser steps on (switch, light, out, ancilla).
+    # Every configuration is built once, longer runs are composed from the
+    # halves so that k iterations only take O(log k) distinct blocks.
+    switch_qubits = QuantumRegister(num_lights, name='switch')
+    light_qubits = QuantumRegister(num_lights, name='light')
+    output_qubit = QuantumRegister(1, name='out')
+
+    if num_ancillas > 0:
+        ancilla_qubits = QuantumRegister(num_ancillas, name='ancilla')
+        qc = QuantumCircuit(switch_qubits, light_qubits, output_qubit, ancilla_qubits)
+    else:
+        ancilla_qubits = None
+        qc = QuantumCircuit(switch_qubits, light_qubits, output_qubit)
+
+    if num_iterations == 1:
+        lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits, mode)
+        diffuser(qc, switch_qubits, ancilla_qubits, mode)
+    else:
+        half = lights_out_iterations_gate(num_lights, num_ancillas, num_iterations // 2, mode)
+        qc.append(half, qc.qubits)
+        qc.append(half, qc.qubits)
+        if num_iterations % 2:
+            qc.append(lights_out_iterations_gate(num_lights, num_ancillas, 1, mode), qc.qubits)
+
+    iterations = qc.to_gate()
+    iterations.name = f"$G^{{{num_iterations}}}$"
+
+    return iterations
+
+
+def lights_out_grover_num_ancillas(num_lights):
+    # The oracle MCT on all lights needs the most
+    return max(0, num_lights - 2)
+
+
+def lights_out_grover(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits=None, num_iterations=1,
+                      mode='basic'):
+    if num_iterations == 0:
+        return
+
+    num_ancillas = 0 if ancilla_qubits is None else len(ancilla_qubits)
+    iterations = lights_out_iterations_gate(len(switch_qubits), num_ancillas, num_iterations, mode)
+
+    qubits = switch_qubits[:] + light_qubits[:] + output_qubit[:]
+    if ancilla_qubits is not None:
+        qubits += ancilla_qubits[:]
+
+    qc.append(iterations, qubits)
+
+
+def lights_out_search(lights, num_iterations=1, phases=None):
+    # Switch search for a single board, measured switches with clbit i =
+    # switch i. Grover with num_iterations, or fixed-point amplification with
+    # phases from utils.amplification.fixed_point_phases.
+    num_lights = len(lights)
+
+    switch_qubits = QuantumRegister(num_lights, name='switch')
+    light_qubits = QuantumRegister(num_lights, name='light')
+    output_qubit = QuantumRegister(1, name='out')
+    ancilla_qubits = QuantumRegister(lights_out_grover_num_ancillas(num_lights), name='ancilla')
+    cbits = ClassicalRegister(num_lights, name="cbits")
+    qc = QuantumCircuit(switch_qubits, light_qubits, output_qubit, ancilla_qubits, cbits)
+    if not len(ancilla_qubits):
+        ancilla_qubits = None
+
+    qc.h(switch_qubits)
+    init_light_states(qc, lights, light_qubits)
+
+    if phases is None:
+        # Flag to |->
+        qc.x(output_qubit)
+        qc.h(output_qubit)
+        lights_out_grover(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits, num_iterations)
+    else:
+        for oracle_phase, diffuser_phase in phases:
+            lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits)
+            qc.p(oracle_phase, output_qubit)
+            lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits)
+            diffuser(qc, switch_qubits, phase=diffuser_phase)
+
+    qc.measure(switch_qubits, cbits)
+
+    return qc
+
+
 def single_board_solution(lights, num_iterations=1):
     print("\n===Solution with Instructions===")
 
@@ -85,15 +176,7 @@ def single_board_solution(lights, num_iterations=1):
     qc.measure(switch_qubits, cbits)
     qc = qc.reverse_bits()
 
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend, shots=1000)
-    result = job.result()
-    count = result.get_counts()
-
-    max_k = min(len(count), 10)
-
-    for k in sorted(count, key=count.get, reverse=True)[:max_k]:
-        print(f"Solution: {k}\tCounts: {count[k]}")
+    print_counts(run_circuit(qc), max_k=10)
 
     qc.draw(output='mpl')
     plt.show()
@@ -130,15 +213,7 @@ def single_board_solution_gates(lights, num_iterations=1):
     qc.measure(switch_qubits, cbits)
     qc = qc.reverse_bits()
 
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend, shots=1000)
-    result = job.result()
-    count = result.get_counts()
-
-    max_k = min(len(count), 10)
-
-    for k in sorted(count, key=count.get, reverse=True)[:max_k]:
-        print(f"Solution: {k}\tCounts: {count[k]}")
+    print_counts(run_circuit(qc), max_k=10)
 
     qc.draw(output='mpl')
     plt.show()
@@ -147,12 +222,12 @@ def single_board_solution_gates(lights, num_iterations=1):
 if __name__ == "__main__":
 
     lights = [1, 0, 1, 1]
-    print("\nGround thruth: 0010")
+    print(f"\nGround thruth: {''.join(map(str, solve_lights_out(lights)[0]))}")
     single_board_solution(lights, num_iterations=1)
     single_board_solution_gates(lights, num_iterations=1)
 
     lights2 = [0, 0, 0, 1, 0, 1, 1, 1, 0]
-    print("Ground thruth: 100110000")
+    print(f"Ground thruth: {''.join(map(str, solve_lights_out(lights2)[0]))}")
     single_board_solution(lights2, num_iterations=1)
     single_board_solution_gates(lights2, num_iterations=1)
 
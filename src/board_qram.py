@@ -1,12 +1,13 @@
 from qiskit import *
 from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit
-from qiskit import IBMQ, Aer, execute
+from qiskit import IBMQ
 
 import numpy as np
 import matplotlib.pyplot as plt
 
 from circuit_parts.diffusers import diffuser_gate
-from utils.board_tools import find_closest_string, board2_bitstrings
+from utils.board_tools import find_closest_string, board2_bitstrings, masks2_bitstrings
+from utils.execution import run_circuit
 from datasets.data import problem_set3x3, problem_set
 
 
@@ -16,19 +17,94 @@ def init_light_states(qc, lights, light_qubits):
             qc.x(light_qubits[i])
 
 
-def write_qram(boards, qc, address_qubits, data_qubits, ancilla_qubits=None):
+def write_qram_num_ancillas(num_address_bits, method='mct'):
+    if method == 'decoder':
+        return max(0, num_address_bits - 1)
+    return max(0, num_address_bits - 2)
+
+
+def write_qram_decoder(boards, closest_lights, qc, address_qubits, data_qubits, ancilla_qubits):
+    # Unary iteration over the address tree. Flag f_l = "the first l address
+    # bits match the current node" lives on ancilla l - 2 (f_1 is the address
+    # qubit itself), every node is computed from its parent with one Toffoli,
+    # so a memory of B boards and D differing bits costs O(B) Toffolis plus D
+    # CX instead of D multi-controlled Toffolis.
+    num_address_bits = len(address_qubits)
+    num_boards = len(boards)
+
+    if len(ancilla_qubits or []) < write_qram_num_ancillas(num_address_bits, 'decoder'):
+        raise ValueError(f"The decoder QRAM needs {write_qram_num_ancillas(num_address_bits, 'decoder')} ancillas")
+
+    differing = [np.flatnonzero(np.not_equal(board, closest_lights)) for board in boards]
+
+    def needed(prefix, level):
+        # Does any board below this node differ from the closest string
+        first = prefix << (num_address_bits - level)
+        last = min(num_boards, (prefix + 1) << (num_address_bits - level))
+        return any(len(differing[n]) for n in range(first, last))
+
+    def visit(flag, prefix, level):
+        if level == num_address_bits:
+            for db in differing[prefix]:
+                qc.cx(flag, data_qubits[db])
+            return
+
+        address = address_qubits[level]
+        child = ancilla_qubits[level - 1]
+        zero, one = needed(2 * prefix, level + 1), needed(2 * prefix + 1, level + 1)
+
+        # f_{l+1} for bit 0 is f_l AND NOT a, for bit 1 the two differ by f_l
+        if zero:
+            qc.ccx(flag, address, child)
+            qc.cx(flag, child)
+            visit(child, 2 * prefix, level + 1)
+            if one:
+                qc.cx(flag, child)
+                visit(child, 2 * prefix + 1, level + 1)
+                qc.ccx(flag, address, child)
+            else:
+                qc.cx(flag, child)
+                qc.ccx(flag, address, child)
+        elif one:
+            qc.ccx(flag, address, child)
+            visit(child, 2 * prefix + 1, level + 1)
+            qc.ccx(flag, address, child)
+
+    # The root has no flag, the first address qubit is the flag of both
+    # children
+    if needed(0, 1):
+        qc.x(address_qubits[0])
+        visit(address_qubits[0], 0, 1)
+        qc.x(address_qubits[0])
+    if needed(1, 1):
+        visit(address_qubits[0], 1, 1)
+
+
+def write_qram(boards, qc, address_qubits, data_qubits, ancilla_qubits=None, order='numeric', method='mct'):
 
     num_address_bits = len(address_qubits)
+
+    # The decoder walks the address tree in its own order
+    if method == 'decoder' and order != 'numeric':
+        raise ValueError(f"Address order {order} is only supported with method='mct'")
+
+    # Boards may also be given as packed bitmasks
+    boards = np.asarray(boards)
+    if boards.ndim == 1:
+        boards = masks2_bitstrings(boards, len(data_qubits))
+
     closest_lights, _ = find_closest_string(boards)
     init_light_states(qc, closest_lights, data_qubits)
 
-    num_ancillas = max(0, num_address_bits - 2)
+    if method == 'decoder':
+        write_qram_decoder(boards, closest_lights, qc, address_qubits, data_qubits, ancilla_qubits)
+        return
+    elif method != 'mct':
+        raise ValueError(f"Unknown QRAM method {method}, use 'mct' or 'decoder'")
 
-    for n, board in enumerate(boards):
-        for ab, bit in enumerate(format(n, f"0{num_address_bits}b")):
-            if bit == '0':
-                qc.x(address_qubits[ab])
+    num_ancillas = write_qram_num_ancillas(num_address_bits)
 
+    def write_board(board):
         switches = np.equal(board, closest_lights)
 
         for db, switch in enumerate(switches):
@@ -41,10 +117,43 @@ def write_qram(boards, qc, address_qubits, data_qubits, ancilla_qubits=None):
                     else:
                         qc.mct(address_qubits, data_qubits[db])
 
-        for ab, bit in enumerate(format(n, f"0{num_address_bits}b")):
-            if bit == '0':
+    if order == 'numeric':
+        for n, board in enumerate(boards):
+            for ab, bit in enumerate(format(n, f"0{num_address_bits}b")):
+                if bit == '0':
+                    qc.x(address_qubits[ab])
+
+            write_board(board)
+
+            for ab, bit in enumerate(format(n, f"0{num_address_bits}b")):
+                if bit == '0':
+                    qc.x(address_qubits[ab])
+
+    elif order == 'gray':
+        # Neighbouring addresses differ in one bit, so only that address qubit
+        # is flipped between two boards. flipped holds the inverted address
+        # qubits, bit ab belongs to address_qubits[ab].
+        flipped = 0
+        for i in range(2 ** num_address_bits):
+            n = i ^ (i >> 1)
+            if n >= len(boards):
+                continue
+
+            zeros = sum(1 << ab for ab, bit in enumerate(format(n, f"0{num_address_bits}b")) if bit == '0')
+            for ab in range(num_address_bits):
+                if (flipped ^ zeros) >> ab & 1:
+                    qc.x(address_qubits[ab])
+            flipped = zeros
+
+            write_board(boards[n])
+
+        for ab in range(num_address_bits):
+            if flipped >> ab & 1:
                 qc.x(address_qubits[ab])
 
+    else:
+        raise ValueError(f"Unknown address order {order}, use 'numeric' or 'gray'")
+
 
 def qRAM(lights):
 
@@ -103,12 +212,7 @@ def test_qram_function(lights):
     # Reverse the output string.
     qc = qc.reverse_bits()
 
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend=backend, shots=8000, seed_simulator=12345)
-
-    result = job.result()
-    count = result.get_counts()
-    for string, counts in dict(sorted(count.items())).items():
+    for string, counts in sorted(run_circuit(qc, shots=8000, seed_simulator=12345)):
         print(f"Memory Cell: {string[:num_address_bits]} \tContent: {string[num_address_bits:]} \t Counts:{counts}")
 
     print("\nGroundtruth:")
@@ -144,12 +248,7 @@ def test_qqram_gate(lights):
     # Reverse the output string.
     qc = qc.reverse_bits()
 
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend=backend, shots=8000, seed_simulator=12345)
-
-    result = job.result()
-    count = result.get_counts()
-    for string, counts in dict(sorted(count.items())).items():
+    for string, counts in sorted(run_circuit(qc, shots=8000, seed_simulator=12345)):
         print(f"Memory Cell: {string[:num_address_bits]} \tContent: {string[num_address_bits:]} \t Counts:{counts}")
 
     print("\nGroundtruth:")
@@ -199,12 +298,7 @@ def test_board_qram_grover_read(lights):
     qc = qc.reverse_bits()
 
     # backend = provider.get_backend('ibmq_qasm_simulator')
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend=backend, shots=1000)
-
-    result = job.result()
-    count = result.get_counts()
-    for string, counts in dict(sorted(count.items())).items():
+    for string, counts in sorted(run_circuit(qc, shots=1000)):
         print(f"Board number: {string[:num_address_bits]}\tCounts {counts}\tUncomputed QRAM: {string[num_address_bits:]}")
 
     # qc.draw(output='mpl')
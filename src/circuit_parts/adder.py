@@ -3,6 +3,8 @@ from qiskit import IBMQ, Aer, execute
 
 import matplotlib.pyplot as plt
 
+from functools import lru_cache
+
 def replace_op_half_adder():
     q = QuantumRegister(2, name='operands')
     res = QuantumRegister(1, name='results')
@@ -121,15 +123,9 @@ def counter_4bit(draw=False):
         qc.draw(output='mpl')
         plt.show()
 
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend, shots=1000)
-    result = job.result()
-    count = result.get_counts()
-
-    max_k = min(len(count), 10)
+    from utils.execution import run_circuit, print_counts
 
-    for k in sorted(count, key=count.get, reverse=True)[:max_k]:
-        print(f"Solution: {k}\tCounts: {count[k]}")
+    print_counts(run_circuit(qc), max_k=10)
 
 
 def counter_9bit_gate():
@@ -180,15 +176,178 @@ def counter_9bit(draw=False):
         qc.draw(output='mpl')
         plt.show()
 
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend, shots=1000)
-    result = job.result()
-    count = result.get_counts()
+    from utils.execution import run_circuit, print_counts
+
+    print_counts(run_circuit(qc), max_k=10)
+
+
+# Hamming weight of any number of inputs by a carry-save tree of the in-place
+# adders above. Bits of equal weight are reduced three at a time by a full
+# adder (sum stays in the third operand, carry goes to a fresh ancilla) and a
+# remaining pair by a half adder, until one bit per weight is left. Inputs are
+# not restored, the counter is undone with inverse=True.
+
+@lru_cache(maxsize=32)
+def _adder_tree(num_inputs):
+    # Adders over qubit indices (inputs first, then ancillas) and the index of
+    # the weight bits, least significant first
+    columns = [list(range(num_inputs))]
+    adders = []
+    next_ancilla = num_inputs
+
+    w = 0
+    while w < len(columns):
+        column = columns[w]
+        while len(column) > 1:
+            if w + 1 == len(columns):
+                columns.append([])
+            if len(column) >= 3:
+                adders.append(('FA', column[0], column[1], column[2], next_ancilla))
+                column = column[3:] + [column[2]]
+            else:
+                adders.append(('HA', column[0], column[1], next_ancilla))
+                column = [column[1]]
+            columns[w + 1].append(next_ancilla)
+            next_ancilla += 1
+        columns[w] = column
+        w += 1
+
+    return tuple(adders), tuple(column[0] for column in columns if column)
+
+
+def hamming_weight_num_ancillas(num_inputs):
+    return len(_adder_tree(num_inputs)[0])
+
+
+def hamming_weight(qc, input_qubits, ancilla_qubits=None, inverse=False, relative_phase=False):
+    # Returns the weight qubits, least significant first. With relative_phase
+    # the Toffolis only hold up to a diagonal phase, which cancels if the
+    # counter is undone by its inverse and the block in between uses the
+    # counter qubits only as controls.
+    adders, weight = _adder_tree(len(input_qubits))
+    qubits = list(input_qubits) + list(ancilla_qubits or [])[:len(adders)]
+
+    gates = []
+    for adder in adders:
+        if adder[0] == 'FA':
+            a, b, c, t = [qubits[i] for i in adder[1:]]
+            gates += [('ccx', a, b, t), ('cx', a, b), ('ccx', b, c, t), ('cx', b, c), ('cx', a, b)]
+        else:
+            a, b, t = [qubits[i] for i in adder[1:]]
+            gates += [('ccx', a, b, t), ('cx', a, b)]
+
+    # Every gate is self-inverse
+    for name, *args in reversed(gates) if inverse else gates:
+        if name == 'cx':
+            qc.cx(*args)
+        elif relative_phase:
+            qc.rccx(*args)
+        else:
+            qc.ccx(*args)
+
+    return [qubits[i] for i in weight]
+
+
+def _value_cubes(low, high, num_bits):
+    # Disjoint cubes {bit: value} covering the integers low..high
+    cubes = []
+    value = low
+    while value <= high:
+        size = 0
+        while size < num_bits and value % 2 ** (size + 1) == 0 and value + 2 ** (size + 1) - 1 <= high:
+            size += 1
+        cubes.append({bit: value >> bit & 1 for bit in range(size, num_bits)})
+        value += 2 ** size
+
+    return cubes
+
+
+def _widen_cube(cube, num_bits, max_value):
+    # Drops literals as long as the cube only gains values above max_value,
+    # which the weight never takes
+    def points(cube):
+        return {v for v in range(max_value + 1) if all(v >> bit & 1 == b for bit, b in cube.items())}
+
+    for bit in sorted(cube, reverse=True):
+        wider = {b: v for b, v in cube.items() if b != bit}
+        if points(wider) == points(cube):
+            cube = wider
+
+    return cube
+
+
+def _emit_cubes(qc, cubes, negate, weight_qubits, output_qubit, ancilla_qubits):
+    from circuit_parts.conjunctions import emit_plan
+
+    if negate:
+        qc.x(output_qubit)
+    for cube in cubes:
+        zeros = [weight_qubits[bit] for bit, value in cube.items() if value == 0]
+        if zeros:
+            qc.x(zeros)
+        emit_plan(qc, [('term', tuple(('q', bit) for bit in sorted(cube)))], weight_qubits, output_qubit, ancilla_qubits)
+        if zeros:
+            qc.x(zeros)
+
+
+def _weight_cubes(num_bits, k, max_weight, num_ancillas):
+    # Cheaper of the cubes of 0..k and of the negated complement
+    # k+1..max_weight, as (cubes, negate)
+    from utils.cost_model import gate_cost
+
+    candidates = [(_value_cubes(0, min(k, max_weight), num_bits), False),
+                  (_value_cubes(max(k + 1, 0), max_weight, num_bits), True)]
+
+    best = None
+    for cubes, negate in candidates:
+        cubes = [_widen_cube(cube, num_bits, max_weight) for cube in cubes]
+
+        scratch = QuantumCircuit(num_bits + 1 + num_ancillas)
+        _emit_cubes(scratch, cubes, negate, scratch.qubits[:num_bits], scratch.qubits[num_bits],
+                    scratch.qubits[num_bits + 1:])
+        cost = sum(gate_cost(inst) for inst, _, _ in scratch.data)
+
+        if best is None or cost < best[0]:
+            best = (cost, cubes, negate)
+
+    return best[1], best[2]
+
+
+def weight_at_most_num_ancillas(num_weight_bits, k=None, max_weight=None):
+    # Without k an upper bound for any threshold
+    if k is None:
+        return max(0, num_weight_bits - 2)
+    if max_weight is None:
+        max_weight = 2 ** num_weight_bits - 1
+
+    cubes, _ = _weight_cubes(num_weight_bits, k, max_weight, weight_at_most_num_ancillas(num_weight_bits))
+    return max([0] + [len(cube) - 2 for cube in cubes])
+
+
+def weight_at_most(qc, weight_qubits, k, output_qubit, ancilla_qubits=None, max_weight=None):
+    # output ^= (weight <= k) as an XOR of disjoint cubes, either of 0..k or
+    # of the complement k+1..max_weight. It is its own inverse.
+    if max_weight is None:
+        max_weight = 2 ** len(weight_qubits) - 1
+
+    cubes, negate = _weight_cubes(len(weight_qubits), k, max_weight, len(ancilla_qubits or []))
+    _emit_cubes(qc, cubes, negate, weight_qubits, output_qubit, ancilla_qubits)
+
+
+def hamming_weight_at_most_num_ancillas(num_inputs, k=None):
+    num_weight_bits = len(_adder_tree(num_inputs)[1])
+    return hamming_weight_num_ancillas(num_inputs) + weight_at_most_num_ancillas(num_weight_bits, k, num_inputs)
+
 
-    max_k = min(len(count), 10)
+def hamming_weight_at_most(qc, input_qubits, k, output_qubit, ancilla_qubits=None):
+    # output ^= (number of set inputs <= k), inputs and ancillas are restored
+    ancilla_qubits = list(ancilla_qubits or [])
+    num_counter_ancillas = hamming_weight_num_ancillas(len(input_qubits))
 
-    for k in sorted(count, key=count.get, reverse=True)[:max_k]:
-        print(f"Solution: {k}\tCounts: {count[k]}")
+    weight_qubits = hamming_weight(qc, input_qubits, ancilla_qubits[:num_counter_ancillas], relative_phase=True)
+    weight_at_most(qc, weight_qubits, k, output_qubit, ancilla_qubits[num_counter_ancillas:],
+                   max_weight=len(input_qubits))
+    hamming_weight(qc, input_qubits, ancilla_qubits[:num_counter_ancillas], inverse=True, relative_phase=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+from functools import lru_cache
+from itertools import combinations
+
+from qiskit import QuantumCircuit
+from qiskit.circuit.library import RC3XGate
+
+
+# Oracles of the form out ^= XOR_k AND(terms[k]) over control qubits. A product
+# of 2 or 3 literals shared by several terms is computed once into an ancilla
+# with a relative phase Toffoli, the terms containing it are emitted with the
+# ancilla in place of the literals and the product is uncomputed. Inside that
+# block the ancilla and the inputs are only used as controls, so the relative
+# phases cancel. Products nest, every level holds one more ancilla.
+#
+# A plan is a list of ('term', literals) and ('product', literals, ancilla,
+# plan) entries. Literals are ('q', i) for control qubit i and ('a', j) for
+# ancilla j.
+
+def _term_ancillas(term):
+    # Clean ancillas of the basic MCT v-chain
+    return max(0, len(term) - 2)
+
+
+def _best_product(terms, max_product_size):
+    counts = {}
+    for term in terms:
+        for size in range(2, min(max_product_size, len(term)) + 1):
+            for candidate in combinations(sorted(term), size):
+                counts[candidate] = counts.get(candidate, 0) + 1
+
+    best = None
+    for candidate, count in sorted(counts.items()):
+        gain = count * (len(candidate) - 1)
+        if count >= 2 and (best is None or gain > best[0]):
+            best = (gain, candidate)
+
+    return None if best is None else best[1]
+
+
+def _flat(terms):
+    return [('term', tuple(sorted(term))) for term in terms]
+
+
+def _plan(terms, free, max_product_size, cost):
+    plan = []
+    terms = list(terms)
+
+    while free:
+        product = _best_product(terms, max_product_size)
+        if product is None:
+            break
+
+        group = [term for term in terms if set(product) <= term]
+        rest = [term for term in terms if not set(product) <= term]
+
+        ancilla = ('a', free[0])
+        inner = _plan([(term - set(product)) | {ancilla} for term in group], free[1:], max_product_size, cost)
+        factored = [('product', product, free[0], inner)]
+
+        if cost(factored) < cost(_flat(group)):
+            plan += factored
+        else:
+            plan += _flat(group)
+        terms = rest
+
+    return plan + _flat(terms)
+
+
+def _outer_ancillas(plan):
+    # Ancillas used as literals but computed outside of the plan
+    used, targets = set(), set()
+    for entry in plan:
+        used |= {index for kind, index in entry[1] if kind == 'a'}
+        if entry[0] == 'product':
+            targets.add(entry[2])
+            used |= _outer_ancillas(entry[3])
+
+    return used - targets
+
+
+def emit_plan(qc, plan, control_qubits, output_qubit, ancilla_qubits=None):
+    ancilla_qubits = list(ancilla_qubits or [])
+
+    def qubit(literal):
+        kind, index = literal
+        return control_qubits[index] if kind == 'q' else ancilla_qubits[index]
+
+    def emit(plan, busy):
+        free = [a for n, a in enumerate(ancilla_qubits) if n not in busy]
+
+        for entry in plan:
+            if entry[0] == 'product':
+                _, product, target, inner = entry
+                qubits = [qubit(literal) for literal in product] + [ancilla_qubits[target]]
+                if len(product) == 2:
+                    qc.rccx(*qubits)
+                else:
+                    qc.rcccx(*qubits)
+
+                emit(inner, busy | {target})
+
+                if len(product) == 2:
+                    qc.rccx(*qubits)
+                else:
+                    qc.append(RC3XGate().inverse(), qubits)
+                continue
+
+            qubits = [qubit(literal) for literal in entry[1]]
+            if not qubits:
+                qc.x(output_qubit)
+            elif len(qubits) == 1:
+                qc.cx(qubits[0], output_qubit)
+            elif len(qubits) == 2:
+                qc.ccx(*qubits, output_qubit)
+            elif _term_ancillas(qubits) <= len(free):
+                qc.mct(qubits, output_qubit, free[:_term_ancillas(qubits)], mode='basic')
+            else:
+                qc.mct(qubits, output_qubit)
+
+    emit(plan, frozenset(_outer_ancillas(plan)))
+
+
+def plan_cost(plan, num_controls, num_ancillas):
+    from utils.cost_model import gate_cost
+
+    qc = QuantumCircuit(num_controls + 1 + num_ancillas)
+    emit_plan(qc, plan, qc.qubits[:num_controls], qc.qubits[num_controls], qc.qubits[num_controls + 1:])
+
+    return sum(gate_cost(inst) for inst, _, _ in qc.data)
+
+
+@lru_cache(maxsize=32)
+def plan_conjunctions(terms, num_controls, num_ancillas, max_product_size=3):
+    # Products are only kept where they are cheaper than the flat MCTs under
+    # the cost model of utils.cost_model. terms is a tuple of tuples.
+    terms = [frozenset(('q', i) for i in term) for term in terms]
+
+    return _plan(terms, list(range(num_ancillas)), max_product_size,
+                 lambda plan: plan_cost(plan, num_controls, num_ancillas))
+
+
+def conjunction_oracle(qc, terms, control_qubits, output_qubit, ancilla_qubits=None, max_product_size=3):
+    num_ancillas = len(ancilla_qubits) if ancilla_qubits is not None else 0
+    plan = plan_conjunctions(tuple(map(tuple, terms)), len(control_qubits), num_ancillas, max_product_size)
+    emit_plan(qc, plan, control_qubits, output_qubit, ancilla_qubits)
@@ -26,7 +26,9 @@ def diffuser_old(nqubits):
     return U_s
 
 
-def diffuser(qc, diffusion_qubits, ancilla_qubits=None):
+def diffuser(qc, diffusion_qubits, ancilla_qubits=None, mode='basic', phase=None):
+    # With phase the reflection becomes I - (1 - e^{i phase})|s><s|, phase=pi
+    # is the usual diffuser
 
     if ancilla_qubits is not None:
         assert len(ancilla_qubits) >= len(diffusion_qubits) - 2
@@ -36,15 +38,22 @@ def diffuser(qc, diffusion_qubits, ancilla_qubits=None):
     # Apply transformation |00..0> -> |11..1> (X-gates)
     qc.x(diffusion_qubits)
 
-    # Do multi-controlled-Z gate
-    qc.h(diffusion_qubits[-1])
-
-    if ancilla_qubits is not None:
-        qc.mct(diffusion_qubits[:-1], diffusion_qubits[-1], ancilla_qubits, mode='basic')
+    if phase is not None:
+        # Multi-controlled phase
+        if len(diffusion_qubits) == 1:
+            qc.p(phase, diffusion_qubits[0])
+        else:
+            qc.mcp(phase, diffusion_qubits[:-1], diffusion_qubits[-1])
     else:
-        qc.mct(diffusion_qubits[:-1], diffusion_qubits[-1])
+        # Do multi-controlled-Z gate
+        qc.h(diffusion_qubits[-1])
+
+        if ancilla_qubits is not None:
+            qc.mct(diffusion_qubits[:-1], diffusion_qubits[-1], ancilla_qubits, mode=mode)
+        else:
+            qc.mct(diffusion_qubits[:-1], diffusion_qubits[-1])
 
-    qc.h(diffusion_qubits[-1])
+        qc.h(diffusion_qubits[-1])
 
     # Apply transformation |11..1> -> |00..0>
     qc.x(diffusion_qubits)
@@ -0,0 +1,133 @@
+import numpy as np
+
+from qiskit import QuantumCircuit
+
+from circuit_parts.conjunctions import plan_conjunctions, plan_cost, emit_plan
+from utils.board_tools import beam_mask_index
+from utils.reversible_sim import truth_table
+
+
+# Oracle synthesis from a truth table. table[x] is the oracle bit for the basis
+# state x of the control register (qubit i is bit i of x). The table is turned
+# into an exclusive sum of products by the Reed-Muller transform, the variable
+# polarities are searched greedily (fixed polarity Reed-Muller forms), every
+# candidate cover is compiled with the conjunction compiler and the cheapest
+# one under the grader cost model is emitted after checking it against the
+# table.
+
+def beam_checker_truth_table(board_dim, function='parity', num_beams=None):
+    # Oracle bit for every content of the board register, which holds the
+    # negated board (1 = no asteroid). 'parity' is what beam_checker computes,
+    # the parity of the number of beam combinations that clear the board,
+    # 'cover' is whether any combination clears it.
+    _, masks, _ = beam_mask_index(board_dim, num_beams)
+    x = np.arange(2 ** (board_dim ** 2), dtype=np.int64)
+
+    hits = np.zeros(len(x), dtype=np.int64)
+    for mask in masks.astype(np.int64):
+        hits += (x & mask) == mask
+
+    if function == 'parity':
+        return (hits & 1).astype(np.uint8)
+    elif function == 'cover':
+        return (hits > 0).astype(np.uint8)
+    raise ValueError(f"Unknown function {function}, use 'parity' or 'cover'")
+
+
+def reed_muller_transform(table, num_vars):
+    # Butterfly over every variable, the transform is its own inverse
+    coefficients = np.array(table, dtype=np.uint8).copy()
+    for i in range(num_vars):
+        coefficients = coefficients.reshape(-1, 2, 2 ** i)
+        coefficients[:, 1, :] ^= coefficients[:, 0, :]
+    return coefficients.reshape(-1)
+
+
+def fprm_terms(table, num_vars, polarity=0):
+    # Products of the fixed polarity Reed-Muller form, variable i enters
+    # negated if bit i of polarity is set
+    index = np.arange(2 ** num_vars) ^ polarity
+    coefficients = reed_muller_transform(np.asarray(table)[index], num_vars)
+
+    return [tuple(i for i in range(num_vars) if m >> i & 1) for m in np.flatnonzero(coefficients)]
+
+
+def _cover_size(terms):
+    return len(terms), sum(len(term) for term in terms)
+
+
+def minimize_fprm(table, num_vars):
+    # Greedy descent over single polarity flips, started from the all positive
+    # and the all negative form. Returns (polarity, terms).
+    best = None
+    for polarity in [0, 2 ** num_vars - 1]:
+        terms = fprm_terms(table, num_vars, polarity)
+        improved = True
+        while improved:
+            improved = False
+            for i in range(num_vars):
+                candidate = fprm_terms(table, num_vars, polarity ^ (1 << i))
+                if _cover_size(candidate) < _cover_size(terms):
+                    polarity, terms, improved = polarity ^ (1 << i), candidate, True
+
+        if best is None or _cover_size(terms) < _cover_size(best[1]):
+            best = (polarity, terms)
+
+    return best
+
+
+def emit_esop(qc, polarity, plan, control_qubits, output_qubit, ancilla_qubits=None):
+    negated = [control_qubits[i] for i in range(len(control_qubits)) if polarity >> i & 1]
+    if negated:
+        qc.x(negated)
+    emit_plan(qc, plan, control_qubits, output_qubit, ancilla_qubits)
+    if negated:
+        qc.x(negated)
+
+
+def esop_circuit(polarity, plan, num_vars, num_ancillas):
+    qc = QuantumCircuit(num_vars + 1 + num_ancillas)
+    emit_esop(qc, polarity, plan, qc.qubits[:num_vars], qc.qubits[num_vars], qc.qubits[num_vars + 1:])
+    return qc
+
+
+def verify_esop(table, polarity, plan, num_vars, num_ancillas):
+    # Output bit and clean ancillas for every basis input, phases of the
+    # relative phase Toffolis cancel by construction of the plan
+    qc = esop_circuit(polarity, plan, num_vars, num_ancillas)
+    outputs, _ = truth_table(qc, range(num_vars), range(num_vars, qc.num_qubits))
+
+    return np.array_equal(outputs, np.asarray(table, dtype=np.uint64))
+
+
+def synthesize_esop(table, num_vars, num_ancillas, covers=()):
+    # Cheapest realization among the minimized FPRM form, the plain ANF and
+    # the given covers (polarity, terms). Returns (polarity, plan, cost).
+    candidates = [minimize_fprm(table, num_vars), (0, fprm_terms(table, num_vars))] + list(covers)
+
+    best = None
+    for polarity, terms in candidates:
+        plan = plan_conjunctions(tuple(map(tuple, terms)), num_vars, num_ancillas)
+        cost = plan_cost(plan, num_vars, num_ancillas) + 2 * bin(polarity).count('1')
+        if best is None or cost < best[2]:
+            best = (polarity, plan, cost)
+
+    if not verify_esop(table, best[0], best[1], num_vars, num_ancillas):
+        raise ValueError("Synthesized oracle does not match the truth table")
+
+    return best
+
+
+def esop_oracle(qc, table, control_qubits, output_qubit, ancilla_qubits=None, covers=()):
+    num_ancillas = len(ancilla_qubits) if ancilla_qubits is not None else 0
+    polarity, plan, _ = synthesize_esop(table, len(control_qubits), num_ancillas, covers)
+    emit_esop(qc, polarity, plan, control_qubits, output_qubit, ancilla_qubits)
+
+
+if __name__ == "__main__":
+    for board_dim in [3, 4]:
+        for function in ['parity', 'cover']:
+            table = beam_checker_truth_table(board_dim, function)
+            polarity, terms = minimize_fprm(table, board_dim ** 2)
+            _, _, cost = synthesize_esop(table, board_dim ** 2, 4)
+            print(f"{board_dim}x{board_dim} {function}: {table.sum()} ones, {len(terms)} products, cost {cost}")
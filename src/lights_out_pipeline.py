@@ -0,0 +1,177 @@
+from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit
+
+import numpy as np
+
+from board_qram import write_qram, write_qram_num_ancillas
+from board_oracles import lights_out_grover, lights_out_grover_num_ancillas, lights_out_iterations_gate
+from circuit_parts.diffusers import diffuser
+from circuit_parts.adder import hamming_weight_at_most, hamming_weight_at_most_num_ancillas
+from utils.ancilla import AncillaAllocator
+
+
+# week2b_ans_func for any board size and number of boards: the address register
+# selects a board from the QRAM, a Grover search on the switches amplifies its
+# solutions, the switch count filter flips the phase of the ones within
+# max_switches, the search and the QRAM are undone and the address diffuser
+# turns the phase into amplitude. All sizes follow from the boards.
+
+def _check_boards(boards):
+    boards = np.asarray(boards)
+    num_boards, num_lights = boards.shape
+    board_size = int(round(np.sqrt(num_lights)))
+
+    if board_size ** 2 != num_lights:
+        raise ValueError(f"Boards of {num_lights} lights are not square")
+    if num_boards < 2 or num_boards & (num_boards - 1):
+        raise ValueError(f"The number of boards must be a power of 2 and at least 2, got {num_boards}")
+
+    return boards, num_boards, num_lights, board_size
+
+
+def _block_cost(build, num_qubits):
+    from utils.cost_model import gate_cost
+
+    qc = QuantumCircuit(num_qubits)
+    build(qc)
+    return sum(gate_cost(inst) for inst, _, _ in qc.data)
+
+
+def plan_lights_out_pipeline(boards, max_switches=3, num_iterations=None, objective='cost_per_success'):
+    # Register sizes, iteration count, qubit count and cost of the pipeline
+    # before any peephole optimization, without building it. Without
+    # num_iterations the count comes from the iteration planner.
+    from utils.cost_model import gate_cost
+
+    boards, num_boards, num_lights, board_size = _check_boards(boards)
+    num_address_bits = int(np.log2(num_boards))
+
+    success = None
+    if num_iterations is None:
+        from utils.grover_planner import plan_lights_out_iterations
+
+        iteration_plan = plan_lights_out_iterations(boards, max_switches, objective)
+        num_iterations, success = iteration_plan['iterations'], iteration_plan['success']
+
+    ancillas = {
+        'qRAM': write_qram_num_ancillas(num_address_bits, 'decoder'),
+        'lights out grover': lights_out_grover_num_ancillas(num_lights),
+        'counter filter': hamming_weight_at_most_num_ancillas(num_lights, max_switches),
+    }
+    num_ancillas = max(ancillas.values())
+
+    n, a = num_lights, num_address_bits
+    costs = {
+        'init': _block_cost(lambda qc: (qc.x(0), qc.h(range(n + a + 1))), n + a + 1),
+        'qRAM': _block_cost(lambda qc: write_qram(boards, qc, qc.qubits[:a], qc.qubits[a:a + n],
+                                                  qc.qubits[a + n:], method='decoder'),
+                            a + n + ancillas['qRAM']),
+        'lights out grover': gate_cost(lights_out_iterations_gate(n, ancillas['lights out grover'], num_iterations)),
+        'counter filter': _block_cost(lambda qc: hamming_weight_at_most(qc, qc.qubits[:n], max_switches, qc.qubits[n],
+                                                                        qc.qubits[n + 1:]),
+                                      n + 1 + ancillas['counter filter']),
+        'diffuser': _block_cost(lambda qc: diffuser(qc, qc.qubits), a),
+    }
+    cost = (costs['init'] + 2 * costs['qRAM'] + 2 * costs['lights out grover'] + costs['counter filter']
+            + costs['diffuser'])
+
+    return {
+        'board_size': board_size,
+        'num_boards': num_boards,
+        'num_lights': num_lights,
+        'num_address_bits': num_address_bits,
+        'max_switches': max_switches,
+        'num_iterations': num_iterations,
+        'success': success,
+        'ancillas': ancillas,
+        'num_qubits': 2 * num_lights + num_address_bits + 1 + num_ancillas,
+        'costs': costs,
+        'cost': cost,
+    }
+
+
+def format_pipeline_plan(plan):
+    lines = [f"{plan['num_boards']} boards {plan['board_size']}x{plan['board_size']}, "
+             f"at most {plan['max_switches']} switches",
+             f"inner iterations: {plan['num_iterations']}"
+             + (f"\tsuccess: {plan['success']:.4f}" if plan['success'] is not None else ""),
+             f"qubits: {plan['num_qubits']}\tcost: {plan['cost']}"]
+    for block, cost in plan['costs'].items():
+        lines.append(f"  {block:<24}{cost:>10}{plan['ancillas'].get(block, 0):>6} ancillas")
+
+    return "\n".join(lines)
+
+
+def lights_out_pipeline(boards, max_switches=3, num_iterations=None, allocator=None, optimize=True,
+                        objective='cost_per_success'):
+    boards, num_boards, num_lights, _ = _check_boards(boards)
+    if num_iterations is None:
+        from utils.grover_planner import plan_lights_out_iterations
+
+        num_iterations = plan_lights_out_iterations(boards, max_switches, objective)['iterations']
+
+    if allocator is None:
+        allocator = AncillaAllocator()
+
+    switch_qubits = QuantumRegister(num_lights, name='switch')
+    light_qubits = QuantumRegister(num_lights, name='light')
+    address_qubits = QuantumRegister(int(np.log2(num_boards)), name='address')
+    output_qubit = QuantumRegister(1, name='out')
+    cbits = ClassicalRegister(len(address_qubits), name="cbits")
+    qc = QuantumCircuit(switch_qubits, light_qubits, address_qubits, allocator.register, output_qubit, cbits)
+
+    # Initialization
+    # Flag to |->
+    qc.x(output_qubit)
+    qc.h(output_qubit)
+
+    # Address and switches to uniform superposition
+    qc.h(address_qubits)
+    qc.h(switch_qubits)
+    qc.barrier()
+
+    with allocator.scope(qc, write_qram_num_ancillas(len(address_qubits), 'decoder'), "qRAM") as ancilla_qubits:
+        write_qram(boards, qc, address_qubits, light_qubits, ancilla_qubits, method='decoder')
+    qc.barrier()
+
+    with allocator.scope(qc, lights_out_grover_num_ancillas(num_lights), "lights out grover") as ancilla_qubits:
+        lights_out_grover(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits, num_iterations)
+    qc.barrier()
+
+    num_filter_ancillas = hamming_weight_at_most_num_ancillas(num_lights, max_switches)
+    with allocator.scope(qc, num_filter_ancillas, "counter filter") as ancilla_qubits:
+        hamming_weight_at_most(qc, switch_qubits, max_switches, output_qubit, ancilla_qubits)
+
+    with allocator.scope(qc, lights_out_grover_num_ancillas(num_lights), "lights out grover") as ancilla_qubits:
+        lights_out_grover(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits, num_iterations)
+    qc.barrier()
+
+    with allocator.scope(qc, write_qram_num_ancillas(len(address_qubits), 'decoder'), "qRAM uncompute") as ancilla_qubits:
+        write_qram(boards, qc, address_qubits, light_qubits, ancilla_qubits, method='decoder')
+    diffuser(qc, address_qubits)
+
+    qc.barrier()
+    qc.measure(address_qubits, cbits)
+
+    qc = allocator.compact(qc)
+    if optimize:
+        from utils.peephole import optimize_circuit
+
+        qc, _ = optimize_circuit(qc)
+    qc = qc.reverse_bits()
+
+    return qc
+
+
+if __name__ == "__main__":
+    from utils.board_tools import compute_switch_edges
+
+    rng = np.random.default_rng(0)
+
+    for board_size, num_boards in [(3, 4), (4, 4), (5, 4)]:
+        # One board solvable within 3 switches, the others with random lights
+        boards = rng.integers(0, 2, size=(num_boards, board_size ** 2))
+        boards[0] = 0
+        for switch in rng.choice(board_size ** 2, 3, replace=False):
+            boards[0, list(compute_switch_edges(board_size)[switch])] ^= 1
+        print(format_pipeline_plan(plan_lights_out_pipeline(boards, max_switches=3)))
+        print()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules import each other both as utils.x and as x
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in [SRC, os.path.join(SRC, 'utils')]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
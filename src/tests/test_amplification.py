@@ -0,0 +1,18 @@
+import math
+
+from utils.amplification import expected_oracle_calls, oracle_calls, search
+
+
+def test_round_without_iterations_is_counted():
+    assert oracle_calls(('grover', 0)) == 1
+
+    item, calls, rounds = search(lambda step: 3, lambda item: True, 16, 'bbht', rng=0)
+    assert (item, calls, rounds) == (3, 1, 1)
+
+
+def test_fixed_count_that_never_succeeds_does_not_converge():
+    # One iteration at 12 of 16 marked rotates onto the unmarked states
+    calls, rounds, found = expected_oracle_calls('fixed', 16, 12, trials=20, num_iterations=1)
+
+    assert found == 0
+    assert math.isnan(calls) and math.isnan(rounds)
@@ -0,0 +1,27 @@
+import pytest
+
+from qiskit import QuantumRegister, QuantumCircuit
+
+from asteroid_oracles import beam_checker, beam_checker_num_ancillas
+from utils.cost_model import compute_cost
+
+
+def beam_checker_circuit(*args, **kwargs):
+    board_qubits = QuantumRegister(9, name='board')
+    output_qubit = QuantumRegister(1, name='out')
+    ancilla_qubits = QuantumRegister(beam_checker_num_ancillas(3), name='ancilla')
+
+    qc = QuantumCircuit(board_qubits, output_qubit, ancilla_qubits)
+    beam_checker(qc, board_qubits, output_qubit, ancilla_qubits, *args, **kwargs)
+
+    return qc
+
+
+@pytest.mark.parametrize('args, kwargs, method', [((), {'factored': True}, 'factored'),
+                                                  ((), {'factored': False}, 'mct'),
+                                                  ((False,), {}, 'mct')])
+def test_factored_alias(args, kwargs, method):
+    with pytest.warns(DeprecationWarning):
+        qc = beam_checker_circuit(*args, **kwargs)
+
+    assert compute_cost(qc) == compute_cost(beam_checker_circuit(method=method))
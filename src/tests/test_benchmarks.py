@@ -0,0 +1,19 @@
+from utils.benchmarks import compare
+
+
+def run(time, reference, spread=0.02, peak_memory=1000):
+    return {'results': {'case': {'time': time, 'reference': reference, 'spread': spread,
+                                 'peak_memory': peak_memory}}}
+
+
+def test_compare_in_units_of_the_reference():
+    baseline = run(1.0, 0.01)
+
+    # The whole host got twice as slow
+    assert not compare(run(2.0, 0.02), baseline)[0][3]
+    # The case got twice as slow
+    assert compare(run(2.0, 0.01), baseline)[0][3]
+    # Within the noise floor of a noisy case
+    assert not compare(run(1.3, 0.01, spread=0.15), baseline)[0][3]
+    assert compare(run(1.4, 0.01, spread=0.15), baseline)[0][3]
+    assert compare(run(1.0, 0.01, peak_memory=2000), baseline)[0][3]
@@ -0,0 +1,17 @@
+import pytest
+
+from qiskit import QuantumRegister, QuantumCircuit
+
+from board_qram import write_qram, write_qram_num_ancillas
+from datasets.data import lightsout4
+
+
+def test_decoder_rejects_gray_order():
+    address_qubits = QuantumRegister(2, name='address')
+    data_qubits = QuantumRegister(9, name='data')
+    ancilla_qubits = QuantumRegister(write_qram_num_ancillas(2, method='decoder'), name='ancilla')
+    qc = QuantumCircuit(address_qubits, data_qubits, ancilla_qubits)
+
+    with pytest.raises(ValueError):
+        write_qram(lightsout4, qc, address_qubits, data_qubits, ancilla_qubits, order='gray', method='decoder')
+    assert len(qc.data) == 0
@@ -0,0 +1,30 @@
+import itertools
+
+import numpy as np
+
+from utils.board_tools import find_closest_string, find_closest_strings
+from datasets.data import lightsout4
+
+
+def total_distance(bits, strings):
+    return np.sum(np.asarray(strings) != np.asarray(bits)) / len(bits)
+
+
+def test_closest_string_lightsout4():
+    closest, dist = find_closest_string(lightsout4)
+
+    assert closest == [1, 1, 0, 0, 0, 0, 0, 0, 0]
+    assert np.isclose(dist, 11 / 9)
+
+    # Exhaustive minimum over all 2^9 strings
+    best = min(total_distance(bits, lightsout4) for bits in itertools.product([0, 1], repeat=9))
+    assert np.isclose(dist, best)
+
+
+def test_ties_are_equally_close():
+    _, _, ties = find_closest_strings([lightsout4])
+    assert ties[0].tolist() == [False, False, True, True, False, True, False, False, False]
+
+    # The string the exhaustive search returned differs only at a tied bit
+    assert np.isclose(total_distance([1, 1, 0, 1, 0, 0, 0, 0, 0], lightsout4),
+                      total_distance([1, 1, 0, 0, 0, 0, 0, 0, 0], lightsout4))
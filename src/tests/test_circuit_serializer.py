@@ -0,0 +1,106 @@
+import io
+import json
+
+from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+from qiskit.circuit.library import MCXGate
+
+from utils.circuit_serializer import dump, dumps, load, loads, load_arrays, to_dict, from_dict
+from utils.cost_model import compute_cost
+
+
+def round_trips(qc):
+    f = io.BytesIO()
+    dump(qc, f)
+    f.seek(0)
+    return [loads(dumps(qc)), load(f), from_dict(json.loads(json.dumps(to_dict(qc))))]
+
+
+def test_equal_bodies_with_different_names():
+    body = QuantumCircuit(2)
+    body.h(0)
+    body.cx(0, 1)
+    first, second = body.to_gate(), body.to_gate()
+    first.name, second.name = 'circuit-153', 'circuit-156'
+
+    qc = QuantumCircuit(2)
+    qc.append(first, [0, 1])
+    qc.append(second, [1, 0])
+    qc.append(first, [1, 0])
+
+    for loaded in round_trips(qc):
+        assert loaded == qc
+        assert [inst.name for inst, _, _ in loaded.data] == ['circuit-153', 'circuit-156', 'circuit-153']
+
+    # One definition record for both names
+    assert dumps(qc).count(b'"kind":"custom"') == 2
+    assert [entry['name'] for entry in load_arrays(dumps(qc))['table']] == ['h', 'cx', 'circuit-153',
+                                                                             'circuit-156']
+
+
+def test_registers_conditions_and_library_gates():
+    qr, cr = QuantumRegister(3, 'q'), ClassicalRegister(2, 'c')
+    qc = QuantumCircuit(qr, cr)
+    qc.mcp(0.7, [0, 1], 2)
+    qc.append(MCXGate(2, ctrl_state=1), [0, 1, 2])
+    qc.x(1).c_if(cr, 1)
+    qc.measure([0, 1], cr)
+
+    for loaded in round_trips(qc):
+        assert loaded == qc
+        assert compute_cost(loaded) == compute_cost(qc)
+
+
+def test_pipeline_circuit():
+    from week3 import week3_ans_func
+    from utils.board_tools import board2_bitstrings
+    from datasets.data import problem_set
+
+    qc = week3_ans_func(board2_bitstrings(problem_set))
+    for loaded in round_trips(qc):
+        assert loaded == qc
+
+
+def test_controlled_gates():
+    from qiskit.circuit.library import HGate, RYGate
+
+    body = QuantumCircuit(2, name='body')
+    body.h(0)
+    body.cx(0, 1)
+
+    qc = QuantumCircuit(4)
+    qc.append(HGate().control(2), [0, 1, 2])
+    qc.append(HGate().control(2, ctrl_state=2), [0, 1, 2])
+    qc.append(RYGate(0.3).control(2), [2, 0, 1])
+    qc.append(body.to_gate().control(2, ctrl_state=1), [0, 1, 2, 3])
+
+    for loaded in round_trips(qc):
+        assert loaded == qc
+        assert compute_cost(loaded) == compute_cost(qc)
+
+
+def test_unsupported_parameters():
+    import numpy as np
+    import pytest
+
+    from qiskit.circuit.library import Initialize, UnitaryGate
+
+    for inst, num_qubits in [(UnitaryGate(np.eye(2)), 1), (Initialize([0, 1]), 1)]:
+        qc = QuantumCircuit(num_qubits)
+        qc.append(inst, range(num_qubits))
+        with pytest.raises(ValueError):
+            dumps(qc)
+
+
+def test_truncated_input():
+    import pytest
+
+    qc = QuantumCircuit(2)
+    qc.h(0)
+    qc.append(QuantumCircuit(2, name='g').to_gate(), [0, 1])
+    data = dumps(qc)
+
+    for end in range(4, len(data)):
+        with pytest.raises(ValueError, match='truncated'):
+            loads(data[:end])
+        with pytest.raises(ValueError, match='truncated'):
+            load(io.BytesIO(data[:end]))
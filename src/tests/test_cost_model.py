@@ -0,0 +1,52 @@
+import sys
+
+from qiskit import QuantumCircuit
+
+from utils.cost_model import compute_cost, gate_cost, gate_key
+
+
+def test_costs_without_ibmq_provider():
+    from week3 import week3_ans_func
+    from utils.board_tools import board2_bitstrings
+    from datasets.data import problem_set
+
+    assert compute_cost(week3_ans_func(board2_bitstrings(problem_set))) > 0
+    assert 'qiskit.providers.ibmq' not in sys.modules
+
+
+def test_custom_gate_cost():
+    body = QuantumCircuit(2)
+    body.h(0)
+    body.cx(0, 1)
+    gate = body.to_gate()
+
+    qc = QuantumCircuit(2)
+    qc.append(gate, [0, 1])
+    qc.append(gate, [1, 0])
+
+    assert gate_cost(gate) == 11
+    assert compute_cost(qc) == 22
+
+
+def test_gate_key_separates_bodies():
+    a, b = QuantumCircuit(2, name='g'), QuantumCircuit(2, name='g')
+    a.cx(0, 1)
+    b.cx(1, 0)
+
+    assert gate_key(a.to_gate()) != gate_key(b.to_gate())
+    assert gate_key(a.to_gate()) == gate_key(a.copy().to_gate())
+
+
+def test_persistent_cache_is_keyed_on_qiskit_version(tmp_path, monkeypatch):
+    import qiskit
+
+    from utils.cost_model import CostCache
+
+    path = str(tmp_path / 'costs.db')
+    cache = CostCache(path=path)
+    cache.set('gate', 7)
+    cache.close()
+
+    assert CostCache(path=path).get('gate') == 7
+    monkeypatch.setattr(qiskit, '__version__', '0.0.0')
+    assert CostCache(path=path).get('gate') is None
@@ -0,0 +1,52 @@
+import numpy as np
+
+from qiskit import QuantumCircuit
+from qiskit.quantum_info import Operator
+
+from utils.peephole import optimize_circuit
+
+
+def test_inlining_keeps_the_global_phase():
+    body = QuantumCircuit(2, global_phase=np.pi / 3)
+    body.h(0)
+    body.cx(0, 1)
+
+    qc = QuantumCircuit(2)
+    qc.x(0)
+    qc.append(body.to_gate(), [0, 1])
+    qc.x(0)
+
+    optimized, _ = optimize_circuit(qc)
+    assert Operator(optimized) == Operator(qc)
+
+
+def test_boundary_gates_cancel():
+    body = QuantumCircuit(2)
+    body.cx(0, 1)
+    body.h(1)
+
+    qc = QuantumCircuit(2)
+    qc.h(1)
+    qc.cx(0, 1)
+    qc.append(body.to_gate(), [0, 1])
+
+    optimized, report = optimize_circuit(qc)
+    assert len(optimized.data) == 0
+    assert report == {'cancel cx': (1, 20), 'cancel h': (1, 2)}
+    assert Operator(optimized).equiv(Operator(qc))
+
+
+def test_repeated_blocks_stay_opaque():
+    from board_oracles import lights_out_iterations_gate
+
+    block = lights_out_iterations_gate(4, 2, 3)
+    qc = QuantumCircuit(block.num_qubits)
+    qc.h(range(4))
+    qc.append(block, qc.qubits)
+    qc.append(block, qc.qubits)
+
+    optimized, _ = optimize_circuit(qc)
+    assert [inst for inst, _, _ in optimized.data].count(block) == 2
+
+    inlined, _ = optimize_circuit(qc, inline_repeated=True)
+    assert len(inlined.data) > len(qc.data)
@@ -0,0 +1,53 @@
+import os
+import stat
+
+from qiskit import Aer, QuantumCircuit, transpile
+
+from utils.execution import run_circuits
+from utils.transpile_cache import TranspileCache, transpile_circuits
+
+
+def circuits():
+    ghz = QuantumCircuit(3, 3)
+    ghz.h(0)
+    ghz.cx(0, 1)
+    ghz.ccx(0, 1, 2)
+    ghz.measure(range(3), range(3))
+
+    phases = QuantumCircuit(2, 2)
+    phases.h([0, 1])
+    phases.cp(0.3, 0, 1)
+    phases.mcx([0], 1)
+    phases.h([0, 1])
+    phases.measure([0, 1], [0, 1])
+
+    return [ghz, phases]
+
+
+def test_hits_return_the_transpiled_circuits(tmp_path):
+    backend = Aer.get_backend('qasm_simulator')
+    cache = TranspileCache(str(tmp_path / 'cache'))
+
+    cold = transpile_circuits(circuits(), backend, cache=cache)
+    warm = transpile_circuits(circuits(), backend, cache=cache)
+
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert warm == cold == transpile(circuits(), backend, optimization_level=1)
+    assert stat.S_IMODE(os.stat(cache.path).st_mode) == 0o700
+    assert run_circuits(circuits(), 100, 5, transpile_cache=cache) == run_circuits(circuits(), 100, 5)
+
+
+def test_eviction_and_corrupt_entries(tmp_path):
+    backend = Aer.get_backend('qasm_simulator')
+    cache = TranspileCache(str(tmp_path / 'cache'))
+    transpile_circuits(circuits(), backend, cache=cache)
+
+    small = TranspileCache(str(tmp_path / 'small'), max_bytes=cache.size() // 2 + 8)
+    transpile_circuits(circuits(), backend, cache=small)
+    assert small.stats()['entries'] == 1
+
+    key = cache.key(circuits()[0], backend)
+    with open(os.path.join(cache.path, key + '.qcb'), 'wb') as f:
+        f.write(b'not a circuit')
+    assert cache.get(key) is None
+    assert cache.stats()['entries'] == 1
@@ -0,0 +1,8 @@
+from week2b import week2b_ans_func
+from utils.cost_model import compute_cost
+from datasets.data import lightsout4
+
+
+def test_default_iterations_are_pinned():
+    assert compute_cost(week2b_ans_func(lightsout4)) == compute_cost(week2b_ans_func(lightsout4, num_iterations=17))
+    assert compute_cost(week2b_ans_func(lightsout4, num_iterations=None)) < compute_cost(week2b_ans_func(lightsout4))
@@ -0,0 +1,20 @@
+import pytest
+
+from week3 import week3_ans_func, week3_stage_names, compute_circuit_cost
+from utils.board_tools import board2_bitstrings
+from utils.cost_profiler import profile_circuit
+from datasets.data import problem_set
+
+
+@pytest.mark.parametrize('num_iterations', [1, 2, 3])
+def test_profile_stages(num_iterations, capsys):
+    boards = board2_bitstrings(problem_set)
+    qc = week3_ans_func(boards, num_iterations=num_iterations)
+
+    stages = week3_stage_names(num_iterations)
+    assert len(stages) == 3 * num_iterations + 2
+    profile = profile_circuit(qc, stages)
+    assert [child['name'] for child in profile['children']] == stages
+
+    compute_circuit_cost(boards, lambda b: week3_ans_func(b, num_iterations=num_iterations), profile=True)
+    assert "qRAM uncompute" in capsys.readouterr().out
@@ -0,0 +1,217 @@
+import numpy as np
+
+from math import acosh, atan2, cosh, ceil, pi, sqrt, tan
+
+from utils.grover_analytics import grover_success
+
+
+# Amplitude amplification when the number of marked items is not known.
+#   'fixed'        the same Grover iteration count every round
+#   'bbht'         Boyer-Brassard-Hoyer-Tapp: a random count below a bound
+#                  that grows by a constant factor every round
+#   'fixed_point'  Yoder-Low-Chuang: phases that never over-rotate, the
+#                  success is at least 1 - delta^2 for every marked fraction
+#                  above the design fraction, which halves every round
+# Every round samples one item and checks it classically, the search stops at
+# the first marked item. Oracle calls count applications of the oracle that
+# XORs the marking into a flag: one per Grover iteration (the flag is in |->),
+# two per fixed-point step (compute, phase, uncompute) and one for checking
+# the measured item, so a round without iterations is not free.
+
+STRATEGIES = ('fixed', 'bbht', 'fixed_point')
+
+
+def fixed_point_length(delta, min_fraction):
+    # Smallest odd sequence length L that guarantees success 1 - delta^2 for
+    # marked fractions >= min_fraction
+    length = 1
+    while cosh(acosh(1 / delta) / length) > 1 / sqrt(1 - min(min_fraction, 1 - 1e-12)):
+        length += 2
+    return length
+
+
+def fixed_point_phases(length, delta):
+    # (oracle phase, diffuser phase) of every step in order of application.
+    # The oracle multiplies the marked items by e^{i beta}, the diffuser is
+    # I - (1 - e^{i phase})|s><s| with phase = -alpha.
+    num_steps = (length - 1) // 2
+    gamma = 1 / cosh(acosh(1 / delta) / length)
+
+    alphas = [2 * atan2(1, tan(2 * pi * j / length) * sqrt(1 - gamma ** 2)) for j in range(1, num_steps + 1)]
+    betas = [-alphas[num_steps - j] for j in range(1, num_steps + 1)]
+
+    return [(beta, -alpha) for alpha, beta in zip(alphas, betas)]
+
+
+def fixed_point_success(num_items, num_marked, phases):
+    # Exact, in the plane of the uniform marked and unmarked states
+    if num_marked == 0:
+        return 0.0
+
+    s = np.array([sqrt(num_marked / num_items), sqrt(1 - num_marked / num_items)], dtype=complex)
+    state = s.copy()
+    for oracle_phase, diffuser_phase in phases:
+        state[0] *= np.exp(1j * oracle_phase)
+        state = state - (1 - np.exp(1j * diffuser_phase)) * s * np.vdot(s, state)
+
+    return float(abs(state[0]) ** 2)
+
+
+def bbht_schedule(num_items, rng, growth=6 / 5):
+    # Iteration counts of the rounds, each uniform below the current bound
+    bound = 1.0
+    while True:
+        yield int(rng.integers(0, ceil(bound)))
+        bound = min(growth * bound, sqrt(num_items))
+
+
+def oracle_calls(step):
+    kind, parameter = step
+    return 1 + (parameter if kind == 'grover' else 2 * len(parameter))
+
+
+def search(sample, verify, num_items, strategy='bbht', rng=None, num_iterations=1, delta=0.5, growth=6 / 5,
+           max_oracle_calls=None):
+    # sample(step) draws one item after the amplification step ('grover', k)
+    # or ('fixed_point', phases). Returns (item or None, oracle calls, rounds).
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy}, use one of {', '.join(STRATEGIES)}")
+
+    rng = np.random.default_rng(rng)
+    if max_oracle_calls is None:
+        max_oracle_calls = 100 * int(ceil(sqrt(num_items)))
+
+    if strategy == 'bbht':
+        steps = (('grover', k) for k in bbht_schedule(num_items, rng, growth))
+    elif strategy == 'fixed_point':
+        def fixed_point_steps():
+            min_fraction = 1 / 2
+            while True:
+                yield 'fixed_point', fixed_point_phases(fixed_point_length(delta, min_fraction), delta)
+                min_fraction = max(min_fraction / 2, 1 / num_items)
+        steps = fixed_point_steps()
+    else:
+        steps = iter(lambda: ('grover', num_iterations), None)
+
+    calls = rounds = 0
+    for step in steps:
+        if calls + oracle_calls(step) > max_oracle_calls:
+            break
+
+        item = sample(step)
+        calls += oracle_calls(step)
+        rounds += 1
+        if verify(item):
+            return item, calls, rounds
+
+    return None, calls, rounds
+
+
+def analytic_sampler(num_items, marked, rng=None):
+    # Draws items from the exact output distribution instead of a simulation
+    rng = np.random.default_rng(rng)
+    marked = np.asarray(sorted(marked), dtype=int)
+    unmarked = np.setdiff1d(np.arange(num_items), marked)
+
+    def sample(step):
+        kind, parameter = step
+        if kind == 'grover':
+            success = grover_success(num_items, len(marked), parameter)
+        else:
+            success = fixed_point_success(num_items, len(marked), parameter)
+
+        if len(marked) and (not len(unmarked) or rng.random() < success):
+            return int(rng.choice(marked))
+        return int(rng.choice(unmarked))
+
+    return sample
+
+
+def expected_oracle_calls(strategy, num_items, num_marked, trials=200, seed=0, **options):
+    # Mean oracle calls and rounds (circuit runs) of the searches that found a
+    # marked item and the fraction of those. Searches that hit the call limit
+    # are left out of the means, which are nan if none succeeded.
+    rng = np.random.default_rng(seed)
+    marked = set(range(num_marked))
+
+    calls, rounds = [], []
+    for _ in range(trials):
+        sample = analytic_sampler(num_items, marked, rng)
+        item, num_calls, num_rounds = search(sample, marked.__contains__, num_items, strategy, rng, **options)
+        if item is not None:
+            calls.append(num_calls)
+            rounds.append(num_rounds)
+
+    if not calls:
+        return float('nan'), float('nan'), 0.0
+    return float(np.mean(calls)), float(np.mean(rounds)), len(calls) / trials
+
+
+def asteroid_sampler(boards, method='sparse', seed=None):
+    # One shot of week3_ans_func or its fixed-point version per step, returns
+    # the measured address
+    from week3 import week3_ans_func, week3_fixed_point_func
+    from utils.execution import run_circuit, decode_address
+
+    rng = np.random.default_rng(seed)
+
+    def sample(step):
+        kind, parameter = step
+        if kind == 'grover':
+            qc = week3_ans_func(boards, num_iterations=parameter)
+        else:
+            qc = week3_fixed_point_func(boards, parameter)
+
+        counts = run_circuit(qc, shots=1, seed_simulator=int(rng.integers(2 ** 31)), method=method)
+        return decode_address(counts[0][0])
+
+    return sample
+
+
+def lights_out_sampler(lights, method='sparse', seed=None):
+    # One shot of the single board switch search, returns the switches as
+    # packed int (bit i is switch i)
+    from board_oracles import lights_out_search
+    from utils.execution import run_circuit
+
+    rng = np.random.default_rng(seed)
+
+    def sample(step):
+        kind, parameter = step
+        if kind == 'grover':
+            qc = lights_out_search(lights, num_iterations=parameter)
+        else:
+            qc = lights_out_search(lights, phases=parameter)
+
+        counts = run_circuit(qc, shots=1, seed_simulator=int(rng.integers(2 ** 31)), method=method)
+        return int(counts[0][0], 2)
+
+    return sample
+
+
+if __name__ == "__main__":
+    from utils.asteroid_solver import beam_checker_parity
+    from utils.board_tools import board2_bitstrings
+    from datasets.data import problem_set
+
+    # Oracle calls / rounds per solved search while the marked count varies:
+    # addresses of 16 boards and switch settings of a 3x3 board. A strategy
+    # that misses some searches of a workload does not converge on it.
+    for num_items, workloads in [(16, [1, 2, 3, 4, 6, 8, 12]), (512, [1, 2, 4, 16, 64])]:
+        print(f"{num_items} items, marked: {workloads}")
+        for strategy, options in [('fixed', {'num_iterations': 1}), ('fixed', {'num_iterations': 3}),
+                                  ('bbht', {}), ('fixed_point', {})]:
+            results = [expected_oracle_calls(strategy, num_items, m, **options) for m in workloads]
+            label = strategy + "".join(f" {k}={v}" for k, v in options.items())
+            converged = all(found == 1 for _, _, found in results)
+            print(f"  {label:<22}"
+                  + "".join(f"{calls:>8.1f}/{rounds:<5.1f}" if found == 1 else f"{'n/c':>14}"
+                            for calls, rounds, found in results)
+                  + (f"  mean calls {np.mean([r[0] for r in results]):.1f}" if converged else "  does not converge"))
+
+    # The real thing on the asteroid boards, sampled from the circuits
+    boards = board2_bitstrings(problem_set)
+    marked = set(np.flatnonzero(beam_checker_parity(boards)).tolist())
+    for strategy in ['bbht', 'fixed_point']:
+        item, calls, rounds = search(asteroid_sampler(boards, seed=1), marked.__contains__, len(boards), strategy, rng=1)
+        print(f"{strategy}: address {item} after {calls} oracle calls in {rounds} rounds")
@@ -0,0 +1,189 @@
+import numpy as np
+
+from contextlib import contextmanager
+
+from qiskit import QuantumCircuit
+from qiskit.circuit import AncillaRegister, Barrier
+
+from utils.reversible_sim import find_nonclassical_gates, simulate_reversible
+from utils.sparse_sim import sparse_statevector
+
+
+# Ancillas are borrowed by the blocks of a pipeline for the span of the block
+# and go back to the pool afterwards, so consecutive blocks share the same
+# qubits. The pool starts with an upper bound, the high-water mark is the
+# minimum register width of the pipeline and compact() shrinks the register
+# to it once the circuit is built.
+
+class AncillaAllocator:
+
+    def __init__(self, max_ancillas=32, name='ancilla'):
+        self.register = AncillaRegister(max_ancillas, name=name)
+        self.width = 0
+        # (label, register indices, first instruction, end instruction)
+        self.scopes = []
+        self._free = list(range(max_ancillas))
+
+    def borrow(self, num_ancillas):
+        if num_ancillas > len(self._free):
+            raise ValueError(f"Requested {num_ancillas} ancillas, only {len(self._free)} of "
+                             f"{self.register.size} are free")
+
+        # Lowest indices first keeps the high-water mark small
+        indices, self._free = self._free[:num_ancillas], self._free[num_ancillas:]
+        if indices:
+            self.width = max(self.width, indices[-1] + 1)
+
+        return indices
+
+    def release(self, indices):
+        self._free = sorted(self._free + list(indices))
+
+    def qubits(self, indices):
+        return [self.register[i] for i in indices]
+
+    @contextmanager
+    def scope(self, qc, num_ancillas, label=None):
+        # Yields the borrowed qubits, or None if the block needs none, and
+        # records the instructions of the block for check_clean
+        indices = self.borrow(num_ancillas)
+        start = len(qc.data)
+        try:
+            yield self.qubits(indices) if indices else None
+        finally:
+            self.release(indices)
+            if indices:
+                self.scopes.append((label or f"block {len(self.scopes)}", indices, start, len(qc.data)))
+
+    def compact(self, qc):
+        # Copy of qc with the ancilla register cut down to the used width
+        register = AncillaRegister(self.width, name=self.register.name)
+        qregs = [register if r is self.register else r for r in qc.qregs]
+
+        compacted = QuantumCircuit(*qregs, *qc.cregs, name=qc.name)
+        qubit_map = {q: q for r in qc.qregs if r is not self.register for q in r}
+        qubit_map.update({self.register[i]: register[i] for i in range(self.width)})
+        clbit_map = dict(zip(qc.clbits, compacted.clbits))
+
+        for inst, qargs, cargs in qc.data:
+            if isinstance(inst, Barrier):
+                # Barriers are the only instructions on the unused ancillas
+                qargs = [qubit_map[q] for q in qargs if q in qubit_map]
+                compacted.append(Barrier(len(qargs)), qargs)
+            else:
+                compacted.append(inst, [qubit_map[q] for q in qargs], [clbit_map[c] for c in cargs])
+
+        self.register = register
+        self._free = [i for i in self._free if i < self.width]
+
+        return compacted
+
+
+def _block_circuit(qc, start, stop):
+    # Instructions start:stop on just the qubits they touch
+    data = qc.data[start:stop]
+    touched = []
+    for _, qargs, _ in data:
+        touched += [q for q in qargs if q not in touched]
+
+    block = QuantumCircuit(len(touched))
+    index = {q: i for i, q in enumerate(touched)}
+    for inst, qargs, _ in data:
+        if inst.name == 'measure':
+            continue
+        block.append(inst, [block.qubits[index[q]] for q in qargs])
+
+    return block, index
+
+
+def _block_inputs(input_bits, max_inputs, rng):
+    # All assignments of the input bits, or a random sample of max_inputs
+    if len(input_bits) <= np.log2(max_inputs):
+        m = np.arange(2 ** len(input_bits), dtype=np.uint64)
+    else:
+        m = rng.integers(0, 2 ** min(len(input_bits), 63), size=max_inputs, dtype=np.uint64)
+        if len(input_bits) > 63:
+            m = m | (rng.integers(0, 2, size=max_inputs, dtype=np.uint64) << np.uint64(63))
+
+    inputs = np.zeros(len(m), dtype=np.uint64)
+    for j, q in enumerate(input_bits):
+        inputs |= ((m >> np.uint64(j)) & np.uint64(1)) << np.uint64(q)
+
+    return inputs
+
+
+def dirty_inputs(block, ancilla_bits, max_inputs=256, seed=None):
+    # Basis inputs with clean ancillas after which the block leaves an
+    # ancilla set. Classical blocks run bit-parallel, others on the sparse
+    # simulator, one input at a time.
+    rng = np.random.default_rng(seed)
+    input_bits = [q for q in range(block.num_qubits) if q not in ancilla_bits]
+    inputs = _block_inputs(input_bits, max_inputs, rng)
+    ancilla_mask = sum(1 << q for q in ancilla_bits)
+
+    if not find_nonclassical_gates(block):
+        outputs, _ = simulate_reversible(block, inputs)
+        return inputs[(outputs & np.uint64(ancilla_mask)) != 0]
+
+    dirty = []
+    for value in inputs:
+        prepared = QuantumCircuit(block.num_qubits)
+        for q in range(block.num_qubits):
+            if int(value) >> q & 1:
+                prepared.x(q)
+        prepared.compose(block, inplace=True)
+
+        state, _ = sparse_statevector(prepared)
+        if state.any_set(ancilla_mask):
+            dirty.append(value)
+
+    return np.array(dirty, dtype=np.uint64)
+
+
+def check_clean(qc, allocator, max_inputs=256, seed=None):
+    # Per borrowed scope: label, whether its ancillas always end in |0> and a
+    # failing basis input of the touched qubits (bit i is the i-th touched
+    # qubit in order of appearance)
+    report = []
+    for label, indices, start, stop in allocator.scopes:
+        block, index = _block_circuit(qc, start, stop)
+        ancilla_bits = [index[q] for q in allocator.qubits(indices) if q in index]
+        dirty = dirty_inputs(block, ancilla_bits, max_inputs, seed) if ancilla_bits else []
+
+        report.append((label, len(dirty) == 0, int(dirty[0]) if len(dirty) else None))
+
+    return report
+
+
+def format_clean_report(report):
+    lines = []
+    for label, clean, failing in report:
+        status = "clean" if clean else f"DIRTY (input {failing:b})"
+        lines.append(f"{label:<32}{status}")
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from week2b import week2b_ans_func
+    from week3 import week3_ans_func
+    from utils.board_tools import board2_bitstrings
+    from datasets.data import problem_set
+
+    lightsout4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+                  [1, 0, 1, 0, 0, 0, 1, 1, 0],
+                  [1, 0, 1, 1, 1, 1, 0, 0, 1],
+                  [1, 0, 0, 0, 0, 0, 1, 0, 0]
+                  ]
+
+    # The peephole pass renumbers the instructions, the scopes need the raw circuit
+    for name, builder in [("week2b", lambda a: week2b_ans_func(lightsout4, allocator=a, optimize=False)),
+                          ("week3", lambda a: week3_ans_func(board2_bitstrings(problem_set), allocator=a,
+                                                             optimize=False))]:
+        allocator = AncillaAllocator()
+        qc = builder(allocator)
+        if name == "week2b":
+            # Undo the final reverse_bits, the scopes refer to the unreversed qubits
+            qc = qc.reverse_bits()
+        print(f"{name}: {allocator.width} ancillas, {qc.num_qubits} qubits")
+        print(format_clean_report(check_clean(qc, allocator, max_inputs=64, seed=0)))
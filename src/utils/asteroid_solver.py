@@ -0,0 +1,135 @@
+import numpy as np
+
+from utils.board_tools import boards2_masks, bitstrings2_masks, beam_mask_index
+
+
+# A board is a bipartite graph between rows and columns with one edge per
+# asteroid. A beam clears a row or a column, so the minimum number of beams is
+# a minimum vertex cover, which by Koenig's theorem equals the size of a
+# maximum matching.
+
+def row_adjacency(boards, num_rows, num_cols=None):
+    if num_cols is None:
+        num_cols = num_rows
+
+    if num_cols > 64:
+        raise ValueError(f"Boards with {num_cols} columns do not fit into a 64 bit row mask")
+
+    boards = np.asarray(boards)
+    if boards.ndim == 1:
+        # Packed board masks, tile (i, j) in bit num_cols * i + j
+        shifts = (num_cols * np.arange(num_rows)).astype(np.uint64)
+        row_mask = np.uint64((1 << num_cols) - 1)
+        return (boards.astype(np.uint64)[:, np.newaxis] >> shifts) & row_mask
+
+    # Bitstrings, one row per board
+    grids = np.atleast_2d(boards).reshape(-1, num_rows, num_cols).astype(np.uint64)
+    weights = np.left_shift(np.uint64(1), np.arange(num_cols, dtype=np.uint64))
+    return np.bitwise_or.reduce(grids * weights, axis=2)
+
+
+def max_matching(rows, num_cols):
+    col_match = [-1] * num_cols
+
+    def augment(r, visited):
+        cols = rows[r] & ~visited[0]
+        while cols:
+            c = (cols & -cols).bit_length() - 1
+            cols &= cols - 1
+            visited[0] |= 1 << c
+            if col_match[c] < 0 or augment(col_match[c], visited):
+                col_match[c] = r
+                return True
+        return False
+
+    size = 0
+    for r in range(len(rows)):
+        if rows[r] and augment(r, [0]):
+            size += 1
+
+    return size, col_match
+
+
+def as_batch(board):
+    # A single packed mask or a single bitstring
+    return [board] if np.ndim(board) else np.atleast_1d(board)
+
+
+def min_beam_cover(board, num_rows, num_cols=None):
+    if num_cols is None:
+        num_cols = num_rows
+
+    rows = [int(r) for r in row_adjacency(as_batch(board), num_rows, num_cols)[0]]
+    _, col_match = max_matching(rows, num_cols)
+
+    # Koenig: walk alternating paths from the unmatched rows
+    matched_rows = {r for r in col_match if r >= 0}
+    visited_rows = {r for r in range(num_rows) if r not in matched_rows}
+    visited_cols = 0
+    frontier = list(visited_rows)
+
+    while frontier:
+        r = frontier.pop()
+        cols = rows[r] & ~visited_cols
+        visited_cols |= cols
+        while cols:
+            c = (cols & -cols).bit_length() - 1
+            cols &= cols - 1
+            if col_match[c] >= 0 and col_match[c] not in visited_rows:
+                visited_rows.add(col_match[c])
+                frontier.append(col_match[c])
+
+    beam_rows = [r for r in range(num_rows) if r not in visited_rows]
+    beam_cols = [c for c in range(num_cols) if visited_cols >> c & 1]
+
+    return beam_rows, beam_cols
+
+
+def min_beams(board, num_rows, num_cols=None):
+    return int(min_beams_batch(as_batch(board), num_rows, num_cols)[0])
+
+
+def min_beams_batch(boards, num_rows, num_cols=None):
+    if num_cols is None:
+        num_cols = num_rows
+
+    adjacency = row_adjacency(boards, num_rows, num_cols)
+
+    # Problem banks repeat boards, solve every distinct one once
+    unique_rows, inverse = np.unique(adjacency, axis=0, return_inverse=True)
+    sizes = np.array([max_matching([int(r) for r in rows], num_cols)[0] for rows in unique_rows], dtype=np.int64)
+
+    return sizes[inverse.reshape(-1)]
+
+
+def unclearable_boards(boards, max_beams, num_rows, num_cols=None):
+    return np.flatnonzero(min_beams_batch(boards, num_rows, num_cols) > max_beams)
+
+
+def beam_checker_parity(boards, board_size=4, num_beams=None):
+    # The function asteroid_oracles.beam_checker puts on its output qubit: it
+    # applies one MCT per beam combination, so the output is the parity of the
+    # number of combinations that clear the board
+    boards = np.asarray(boards)
+    if boards.ndim == 2:
+        boards = bitstrings2_masks(boards)
+
+    _, uncovered, _ = beam_mask_index(board_size, num_beams)
+    clears = (boards.astype(np.uint64)[:, np.newaxis] & uncovered.astype(np.uint64)[np.newaxis, :]) == 0
+
+    return clears.sum(axis=1) % 2
+
+
+def asteroid_boards_min_beams(asteroid_boards, board_size=4):
+    return min_beams_batch(boards2_masks(asteroid_boards, board_size), board_size)
+
+
+if __name__ == "__main__":
+    from datasets.data import problem_set, q1, q2, q3
+
+    print(min_beams([1, 0, 0, 0, 1, 0, 0, 0, 1], 3))
+    print(min_beam_cover(bitstrings2_masks([1, 1, 0, 0, 1, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1])[0], 4))
+
+    for name, problems in zip(["problem_set", "q1", "q2", "q3"], [problem_set, q1, q2, q3]):
+        beams = asteroid_boards_min_beams(problems)
+        print(f"{name}: {beams.tolist()}\tNot clearable with 3 beams: {np.flatnonzero(beams > 3).tolist()}")
@@ -0,0 +1,257 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# The modules import each other both as utils.x and as x, so the script runs
+# as python utils/benchmarks.py or python -m utils.benchmarks from src/
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in [SRC, os.path.join(SRC, 'utils')]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import numpy as np
+
+from qiskit import QuantumRegister, QuantumCircuit, Aer, execute
+import qiskit
+
+from board_qram import write_qram
+from board_oracles import lights_out_iterations_gate
+from asteroid_oracles import beam_checker, beam_checker_esop
+from week2b import week2b_ans_func, downsized_problem
+from week3 import week3_ans_func, downsized
+from circuit_parts.adder import counter_4bit_gate, counter_9bit_gate, _adder_tree
+from circuit_parts.conjunctions import plan_conjunctions
+from utils.board_tools import board2_bitstrings, beam_mask_index
+from utils.cost_model import circuit_cost, _cost_cache
+from datasets.data import problem_set, problem_set3x3
+
+
+# Wall time and peak memory of the circuit constructors, of the cost model on
+# their output (circuit_cost, compute_cost without its progress output) and of
+# Aer runs at several problem sizes. Every case is run once to warm up, then
+# with cold caches, cases shorter than MIN_REPETITION_TIME several times per
+# repetition: the median of the repetitions is reported as time and the
+# traced Python/NumPy allocation peak of one more run as memory. A fixed
+# reference workload is timed next to every repetition and times are compared
+# in units of it, so a slower or busier host does not show up as a
+# regression. The spread (interquartile range over median) of the
+# repetitions is the noise floor of a case, a change within twice the spread
+# of both runs is not flagged.
+
+LIGHTSOUT4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+              [1, 0, 1, 0, 0, 0, 1, 1, 0],
+              [1, 0, 1, 1, 1, 1, 0, 0, 1],
+              [1, 0, 0, 0, 0, 0, 1, 0, 0]
+              ]
+
+LIGHTSOUT2X2 = [[1, 0, 1, 1],
+                [0, 1, 1, 0],
+                [1, 1, 0, 1],
+                [0, 0, 0, 1]
+                ]
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+DEFAULT_TIME_THRESHOLD = 0.25
+DEFAULT_MEMORY_THRESHOLD = 0.25
+NOISE_FACTOR = 2
+MIN_REPETITION_TIME = 0.02
+
+
+def clear_caches():
+    lights_out_iterations_gate.cache_clear()
+    beam_mask_index.cache_clear()
+    plan_conjunctions.cache_clear()
+    beam_checker_esop.cache_clear()
+    _adder_tree.cache_clear()
+    _cost_cache.clear()
+
+
+def reference_workload():
+    total = 0
+    for i in range(100000):
+        total += i % 7
+    return total
+
+
+def measure(func, repeat=7):
+    # One-time initialization (lazy imports, qiskit tables) stays out of the
+    # numbers. Short cases are called several times per repetition.
+    clear_caches()
+    start = time.perf_counter()
+    func()
+    number = max(1, int(np.ceil(MIN_REPETITION_TIME / (time.perf_counter() - start))))
+
+    times, references = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        reference_workload()
+        references.append(time.perf_counter() - start)
+
+        elapsed = 0
+        for _ in range(number):
+            clear_caches()
+            gc.collect()
+            start = time.perf_counter()
+            func()
+            elapsed += time.perf_counter() - start
+        times.append(elapsed / number)
+
+    clear_caches()
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {'time': float(median), 'spread': float((q3 - q1) / median), 'reference': float(np.median(references)),
+            'peak_memory': peak}
+
+
+def qram_circuit(boards, num_data_qubits):
+    address_qubits = QuantumRegister(int(np.log2(len(boards))), name='address')
+    data_qubits = QuantumRegister(num_data_qubits, name='data')
+    ancilla_qubits = QuantumRegister(max(1, len(address_qubits) - 2), name='ancilla')
+
+    qc = QuantumCircuit(address_qubits, data_qubits, ancilla_qubits)
+    write_qram(boards, qc, address_qubits, data_qubits, ancilla_qubits)
+
+    return qc
+
+
+def beam_checker_circuit(board_size):
+    board_qubits = QuantumRegister(board_size ** 2, name='board')
+    output_qubit = QuantumRegister(1, name='out')
+    ancilla_qubits = QuantumRegister(7, name='ancilla')
+
+    qc = QuantumCircuit(board_qubits, output_qubit, ancilla_qubits)
+    beam_checker(qc, board_qubits, output_qubit, ancilla_qubits)
+
+    return qc
+
+
+def circuit_cases():
+    # name -> circuit constructor
+    boards4x4 = board2_bitstrings(problem_set)
+    boards3x3 = board2_bitstrings(problem_set3x3, board_size=3)
+
+    return {
+        'week2b_ans_func': lambda: week2b_ans_func(LIGHTSOUT4, num_iterations=17),
+        'week2b_downsized': lambda: downsized_problem(LIGHTSOUT2X2),
+        'week3_ans_func': lambda: week3_ans_func(boards4x4),
+        'week3_downsized': lambda: downsized(boards3x3),
+        'write_qram_4x9': lambda: qram_circuit(LIGHTSOUT4, 9),
+        'write_qram_16x16': lambda: qram_circuit(boards4x4, 16),
+        'beam_checker_3x3': lambda: beam_checker_circuit(3),
+        'beam_checker_4x4': lambda: beam_checker_circuit(4),
+        'counter_4bit': counter_4bit_gate,
+        'counter_9bit': counter_9bit_gate,
+    }
+
+
+# Circuits small enough for a statevector run, the full size pipelines need
+# 28 qubits and are only run with --full
+SIMULATION_CASES = ['week2b_downsized', 'week3_downsized']
+FULL_SIMULATION_CASES = ['week3_ans_func', 'week2b_ans_func']
+
+
+def run_benchmarks(repeat=7, full=False, shots=1000):
+    cases = circuit_cases()
+    results = {}
+
+    for name, constructor in cases.items():
+        results[f"build/{name}"] = measure(constructor, repeat)
+
+        circuit = constructor()
+        results[f"cost/{name}"] = measure(lambda: circuit_cost(circuit), repeat)
+
+    backend = Aer.get_backend('qasm_simulator')
+    for name in SIMULATION_CASES + (FULL_SIMULATION_CASES if full else []):
+        circuit = cases[name]()
+        results[f"aer/{name}"] = measure(lambda: execute(circuit, backend, shots=shots, seed_simulator=42).result(),
+                                         repeat)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'qiskit': qiskit.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'repeat': repeat,
+        },
+        'results': results
+    }
+
+
+def compare(results, baseline, time_threshold=DEFAULT_TIME_THRESHOLD, memory_threshold=DEFAULT_MEMORY_THRESHOLD):
+    # Relative change of every case that is in both runs, times in units of
+    # the reference workload. A case regresses if it got slower by more than
+    # the threshold and the noise floor, or bigger by more than the threshold.
+    rows = []
+    for name, current in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        reference = baseline['results'][name]
+
+        time_change = (current['time'] / current['reference']) / (reference['time'] / reference['reference']) - 1
+        memory_change = current['peak_memory'] / max(reference['peak_memory'], 1) - 1
+        noise = NOISE_FACTOR * (current['spread'] + reference['spread'])
+        regression = time_change > max(time_threshold, noise) or memory_change > memory_threshold
+
+        rows.append((name, time_change, memory_change, regression))
+
+    return rows
+
+
+def format_results(results, comparison=None):
+    changes = {name: (t, m, r) for name, t, m, r in comparison or []}
+
+    lines = [f"{'case':<32}{'time [s]':>12}{'peak [MB]':>12}{'d time':>10}{'d mem':>10}"]
+    for name, result in results['results'].items():
+        line = f"{name:<32}{result['time']:>12.4f}{result['peak_memory'] / 2 ** 20:>12.2f}"
+        if name in changes:
+            time_change, memory_change, regression = changes[name]
+            line += f"{100 * time_change:>9.1f}%{100 * memory_change:>9.1f}%"
+            if regression:
+                line += "  REGRESSION"
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark circuit construction, cost evaluation and simulation")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', default=BASELINE, help="compare against the results in this JSON file")
+    parser.add_argument('--update-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--full', action='store_true', help="also simulate the full size circuits")
+    parser.add_argument('--time-threshold', type=float, default=DEFAULT_TIME_THRESHOLD)
+    parser.add_argument('--memory-threshold', type=float, default=DEFAULT_MEMORY_THRESHOLD)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.full)
+
+    comparison = None
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            comparison = compare(results, json.load(f), args.time_threshold, args.memory_threshold)
+
+    print(format_results(results, comparison))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if comparison and any(regression for *_, regression in comparison):
+        sys.exit(1)
@@ -1,35 +1,121 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
-from scipy.spatial import distance
+from functools import lru_cache
 
 from datasets.data import problem_set3x3, problem_set, lightsout4
 
+
+def find_closest_strings(problem_sets):
+    # Per-bit majority vote over every problem set at once. The total Hamming
+    # distance separates into independent bits, so the majority bit is optimal.
+    # Ties are resolved to 0. Every choice at a tied bit gives the same total
+    # distance, the exhaustive search this replaces picked among the tied
+    # strings by the rounding of its float sums, so it may have returned a
+    # different but equally close string (for lightsout4 [1,1,0,1,0,0,0,0,0]
+    # instead of [1,1,0,0,0,0,0,0,0]).
+    boards = np.asarray(problem_sets, dtype=np.uint8)
+    if boards.ndim == 2:
+        boards = boards[np.newaxis]
+
+    num_boards, length = boards.shape[1:]
+
+    ones = boards.sum(axis=1, dtype=np.int64)
+    zeros = num_boards - ones
+
+    closest = (ones > zeros).astype(np.uint8)
+    ties = ones == zeros
+    dists = np.minimum(ones, zeros).sum(axis=1) / length
+
+    return closest, dists, ties
+
+
 def find_closest_string(strings):
-    length = len(strings[0])
-    min_dist = 1000
-    min_string = None
+    closest, dists, _ = find_closest_strings([strings])
+    return closest[0].tolist(), float(dists[0])
 
-    for i in range(int(2 ** length)):
-        bits = [int(a) for a in format(i, f"0{length}b")]
-        dist = sum([distance.hamming(bits, s) for s in strings])
-        if dist < min_dist:
-            min_dist = dist
-            min_string = bits
 
-    return min_string, min_dist
+def mask_dtype(num_tiles):
+    if num_tiles <= 16:
+        return np.uint16
+    elif num_tiles <= 32:
+        return np.uint32
+    elif num_tiles <= 64:
+        return np.uint64
 
+    raise ValueError(f"Boards with {num_tiles} tiles do not fit into a 64 bit mask")
+
+
+# Tile (i, j) of a board is stored in bit board_size * i + j of its mask, so
+# bit k of a mask is entry k of the corresponding bitstring.
+def boards2_masks(asteroid_boards, board_size=4):
+    dtype = mask_dtype(board_size ** 2)
+    num_boards = len(asteroid_boards)
+
+    try:
+        coords = np.asarray(asteroid_boards, dtype=np.int64).reshape(num_boards, -1, 2)
+        board_idx = np.repeat(np.arange(num_boards), coords.shape[1])
+        coords = coords.reshape(-1, 2)
+    except (TypeError, ValueError):
+        # Boards with different numbers of asteroids
+        lengths = [len(ast_idx) for ast_idx in asteroid_boards]
+        coords = np.asarray([idx for ast_idx in asteroid_boards for idx in ast_idx], dtype=np.int64).reshape(-1, 2)
+        board_idx = np.repeat(np.arange(num_boards), lengths)
+
+    tiles = board_size * coords[:, 0] + coords[:, 1]
+
+    masks = np.zeros(num_boards, dtype=dtype)
+    np.bitwise_or.at(masks, board_idx, np.left_shift(1, tiles).astype(dtype))
+
+    return masks
+
+
+def masks2_boards(masks, board_size=4):
+    bits = masks2_bitstrings(masks, board_size ** 2)
+    board_idx, tiles = np.nonzero(bits)
+    rows, cols = np.divmod(tiles, board_size)
+
+    boards = [[] for _ in range(len(bits))]
+    for b, i, j in zip(board_idx, rows, cols):
+        boards[b].append([str(i), str(j)])
+
+    return boards
+
+
+def bitstrings2_masks(bitstrings):
+    bits = np.asarray(bitstrings, dtype=np.uint64)
+    if bits.ndim == 1:
+        bits = bits[np.newaxis]
+
+    num_tiles = bits.shape[1]
+    weights = np.left_shift(np.uint64(1), np.arange(num_tiles, dtype=np.uint64))
+
+    return np.bitwise_or.reduce(bits * weights, axis=1).astype(mask_dtype(num_tiles))
 
-def board2_bitstrings(asteroid_boards, board_size=4):
-    strings = []
 
-    for ast_idx in asteroid_boards:
-        board = np.zeros((board_size, board_size), dtype=np.uint8)
-        for idx in ast_idx:
-            board[int(idx[0]), int(idx[1])] = 1
-        strings.append(board.flatten().tolist())
+def masks2_bitstrings(masks, num_tiles):
+    masks = np.atleast_1d(np.asarray(masks, dtype=np.uint64))
+    shifts = np.arange(num_tiles, dtype=np.uint64)
 
-    return strings
+    return ((masks[:, np.newaxis] >> shifts) & np.uint64(1)).astype(np.uint8)
+
+
+def masks2_grids(masks, board_size=4):
+    return masks2_bitstrings(masks, board_size ** 2).reshape(-1, board_size, board_size)
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(masks):
+    masks = np.ascontiguousarray(masks)
+    as_bytes = masks.reshape(masks.shape + (1,)).view(np.uint8)
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.int64)
+
+
+def board2_bitstrings(asteroid_boards, board_size=4):
+    masks = boards2_masks(asteroid_boards, board_size)
+    return masks2_bitstrings(masks, board_size ** 2).tolist()
 
 
 def kbits(n, k):
@@ -45,24 +131,45 @@ def kbits(n, k):
     return result
 
 
-def compute_uncovered_tiles(beamstring):
-    board_size = len(beamstring) // 2
-    vertical = np.array(beamstring[:board_size])
-    horizontal = np.array(beamstring[board_size:])
+def beam_masks(beamstrings, board_size):
+    # Beamstrings hold the vertical beams (columns) first and the horizontal
+    # beams (rows) second. A tile is uncovered if neither its row nor its
+    # column is hit.
+    beamstrings = np.atleast_2d(np.asarray(beamstrings, dtype=np.uint64))
+    tiles = np.arange(board_size ** 2, dtype=np.uint64).reshape(board_size, board_size)
+    weights = np.left_shift(np.uint64(1), tiles)
 
-    coord2num = lambda i, j: board_size * i + j
+    column_masks = np.bitwise_or.reduce(weights, axis=0)
+    row_masks = np.bitwise_or.reduce(weights, axis=1)
+
+    free_columns = (1 - beamstrings[:, :board_size]) @ column_masks
+    free_rows = (1 - beamstrings[:, board_size:]) @ row_masks
+
+    return (free_columns & free_rows).astype(mask_dtype(board_size ** 2))
 
-    uncovered_v = vertical == 0
-    uncovered_h = horizontal == 0
 
-    uncovered_tiles = []
+@lru_cache(maxsize=4)
+def beam_mask_index(board_size, num_beams=None):
+    # Every combination of num_beams beams on a board_size x board_size board
+    # with the mask and the list of the tiles it leaves uncovered. Built once per
+    # board size, the least recently used sizes are evicted.
+    if num_beams is None:
+        num_beams = board_size - 1
 
-    for i, h in enumerate(uncovered_h):
-        for j, v in enumerate(uncovered_v):
-            if v and h:
-                uncovered_tiles.append(coord2num(i, j))
+    beamstrings = np.array(kbits(2 * board_size, num_beams), dtype=np.uint8).reshape(-1, 2 * board_size)
+    masks = beam_masks(beamstrings, board_size)
+    tiles = tuple(tuple(np.flatnonzero(bits).tolist()) for bits in masks2_bitstrings(masks, board_size ** 2))
 
-    return uncovered_tiles
+    beamstrings.flags.writeable = False
+    masks.flags.writeable = False
+
+    return beamstrings, masks, tiles
+
+
+def compute_uncovered_tiles(beamstring):
+    board_size = len(beamstring) // 2
+    mask = beam_masks(beamstring, board_size)
+    return np.flatnonzero(masks2_bitstrings(mask, board_size ** 2)[0]).tolist()
 
 
 def plot_boards(asteroid_boards, board_size=4):
@@ -70,13 +177,10 @@ def plot_boards(asteroid_boards, board_size=4):
     num_boards = len(asteroid_boards)
     num_subplots = int(np.sqrt(num_boards))
 
-    fig, axes = plt.subplots(nrows=num_subplots, ncols=num_subplots)
-    for ax, ast_idx in zip(axes.flatten(), asteroid_boards):
-
-        board = np.zeros((board_size, board_size), dtype=np.uint8)
-        for idx in ast_idx:
-            board[int(idx[0]), int(idx[1])] = 1
+    grids = masks2_grids(boards2_masks(asteroid_boards, board_size), board_size)
 
+    fig, axes = plt.subplots(nrows=num_subplots, ncols=num_subplots)
+    for ax, board in zip(axes.flatten(), grids):
         ax.imshow(board)
 
     plt.show()
@@ -117,13 +221,10 @@ if __name__ == "__main__":
     print(compute_uncovered_tiles([1, 1, 0, 0, 0, 0]))
     print(compute_uncovered_tiles([1, 0, 0, 1, 0, 0, 1, 0]))
 
-    uncovered_tiles = []
-    for b in kbits(8, 3):
-        print(f"{b}: {compute_uncovered_tiles(b)}")
-        tiles = [0] * 16
-        for bit in compute_uncovered_tiles(b):
-            tiles[bit] = 1
-        uncovered_tiles.append("".join([str(t) for t in tiles]))
+    beamstrings, masks, tiles = beam_mask_index(4)
+    for b, t in zip(beamstrings, tiles):
+        print(f"{b.tolist()}: {list(t)}")
 
+    uncovered_tiles = ["".join(map(str, bits)) for bits in masks2_bitstrings(masks, 16)]
     for n, ut in enumerate(sorted(uncovered_tiles)):
         print(f"{n+1}:\t{ut}")
@@ -0,0 +1,481 @@
+import io
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister, AncillaRegister
+from qiskit.circuit import Barrier, ControlledGate, Gate, Instruction, Measure, Reset, Qubit, Clbit
+from qiskit.circuit.library import (MCXGate, MCXGrayCode, MCXRecursive, MCXVChain, C3XGate, C4XGate, MCPhaseGate,
+                                    MCU1Gate)
+from qiskit.circuit.library.standard_gates import get_standard_gate_name_mapping
+
+from utils.cost_model import gate_key
+
+
+# Compact binary circuit format. A file is the magic followed by records, the
+# definitions of custom gates first (every body once, deduplicated by
+# gate_key) and the circuit last. A record is a JSON header with the
+# registers, conditions and the gate table entries it introduces, followed by
+# flat arrays (table records in between carry only the entries a definition
+# needs before the record that introduced them is written):
+#   ops     index into the gate table of every instruction
+#   qargs   qubit indices of all instructions, concatenated
+#   cargs   clbit indices of all instructions, concatenated
+#   params  float64 parameters of all instructions, concatenated
+# A gate table entry is a library class rebuilt from its constructor
+# arguments, a custom gate with the index of its definition record, or a
+# controlled gate (Gate.control() outside the library) with the entry of its
+# base gate, its control layout and the definition with closed controls. The
+# arity of an instruction follows from its entry. Records are written and
+# read one at a time, the arrays are aligned to 8 bytes and read as views
+# into the buffer. Only load_arrays hands out these views, building the
+# QuantumCircuit copies them into lists. Labels are not stored, gates without
+# a definition that are not in the library and parameters that are not real
+# numbers (UnitaryGate matrices, Initialize amplitudes) are not supported.
+#
+# circuit_to_json stays the submission format, to_dict gives the same
+# records as JSON-compatible lists.
+
+MAGIC = b'QCB\x01'
+
+_RECORD = struct.Struct('<cI')
+
+_CLASSES = {gate.base_class.__name__: gate.base_class for gate in get_standard_gate_name_mapping().values()}
+_CLASSES.update({cls.__name__: cls for cls in [MCXGate, MCXGrayCode, MCXRecursive, MCXVChain, C3XGate, C4XGate,
+                                               MCPhaseGate, MCU1Gate, Barrier, Measure, Reset]})
+_CLASSES.pop('Delay', None)
+
+# Constructors that take the number of controls after the parameters
+_MULTI_CONTROLLED = (MCXGate, MCPhaseGate, MCU1Gate)
+
+
+def _float_params(inst):
+    try:
+        return [float(p) for p in inst.params]
+    except TypeError:
+        raise ValueError(f"Parameters of {inst.name} are not numeric") from None
+
+
+def _build_library_gate(entry, params):
+    cls = _CLASSES[entry['class']]
+    if cls is Barrier:
+        return Barrier(entry['num_qubits'])
+
+    args = list(params)
+    kwargs = {}
+    if issubclass(cls, _MULTI_CONTROLLED):
+        args.append(entry['num_ctrl_qubits'])
+    if issubclass(cls, MCXVChain):
+        kwargs['dirty_ancillas'] = entry['dirty_ancillas']
+    if entry.get('ctrl_state') is not None and cls is not MCPhaseGate:
+        kwargs['ctrl_state'] = entry['ctrl_state']
+
+    return cls(*args, **kwargs)
+
+
+def _library_entry(inst):
+    # Table entry of a gate that may be rebuilt from its class, None if it
+    # certainly cannot
+    cls = inst.base_class
+    if cls.__name__ not in _CLASSES or _CLASSES[cls.__name__] is not cls:
+        return None
+
+    entry = {'kind': 'library', 'class': cls.__name__, 'name': inst.name, 'num_qubits': inst.num_qubits,
+             'num_clbits': inst.num_clbits, 'num_params': len(inst.params)}
+    if isinstance(inst, ControlledGate):
+        entry['num_ctrl_qubits'] = inst.num_ctrl_qubits
+        entry['ctrl_state'] = inst.ctrl_state
+    if isinstance(inst, MCXVChain):
+        entry['dirty_ancillas'] = bool(inst._dirty_ancillas)
+
+    return entry
+
+
+def _rebuilds(entry, inst):
+    # Library gates are defined by their class and constructor arguments, so
+    # matching signatures suffice (comparing definitions is slow)
+    try:
+        rebuilt = _build_library_gate(entry, _float_params(inst))
+    except (TypeError, ValueError):
+        return False
+
+    return (rebuilt.base_class is inst.base_class and rebuilt.name == inst.name
+            and rebuilt.num_qubits == inst.num_qubits and rebuilt.num_clbits == inst.num_clbits
+            and rebuilt.params == inst.params
+            and getattr(rebuilt, 'ctrl_state', None) == getattr(inst, 'ctrl_state', None))
+
+
+def _index_dtype(size):
+    return np.uint16 if size < 2 ** 16 else np.uint32
+
+
+class _Writer:
+    def __init__(self):
+        self.entries = []
+        self.entry_index = {}
+        # id -> (instruction, entry index), keeps the instructions alive
+        self.memo = {}
+        self.key_memo = {}
+        self.definitions = {}
+        # library entry key -> whether the class rebuilds it, checked once
+        self.rebuilds = {}
+
+    def definition(self, body, qc, new_entries):
+        # Generator of the records of a definition not written yet, returns
+        # its index
+        if body not in self.definitions:
+            # The definition may use the entries that are new so far, they go
+            # out first in a table record
+            if new_entries:
+                yield b'T', {'entries': list(new_entries)}, {}
+                new_entries.clear()
+            yield from self.records(qc)
+            self.definitions[body] = len(self.definitions)
+
+        return self.definitions[body]
+
+    def entry(self, inst, new_entries):
+        # Generator of the records the entry needs first, returns its index
+        if id(inst) in self.memo:
+            return self.memo[id(inst)][1]
+
+        entry = _library_entry(inst)
+        if entry is not None:
+            key = json.dumps(entry, sort_keys=True)
+            if key not in self.rebuilds:
+                self.rebuilds[key] = _rebuilds(entry, inst)
+            if not self.rebuilds[key]:
+                entry = None
+
+        if entry is None and type(inst) is ControlledGate and inst._definition is not None:
+            # The stored definition has closed controls, the control state is
+            # applied again on load. gate_key covers the base gate and the
+            # control layout.
+            base = yield from self.entry(inst.base_gate, new_entries)
+            definition = yield from self.definition('controlled ' + gate_key(inst, self.key_memo),
+                                                    inst._definition, new_entries)
+            entry = {'kind': 'controlled', 'name': inst._name, 'num_qubits': inst.num_qubits, 'num_clbits': 0,
+                     'num_params': len(inst.params), 'num_ctrl_qubits': inst.num_ctrl_qubits,
+                     'ctrl_state': inst.ctrl_state, 'base': base, 'definition': definition}
+            key = json.dumps(entry, sort_keys=True)
+
+        elif entry is None:
+            if inst.definition is None:
+                raise ValueError(f"Cannot serialize {inst.name}, it is not a library gate and has no definition")
+
+            # Gates with equal bodies share the definition record, the entry
+            # keeps the name of each
+            definition = yield from self.definition(gate_key(inst, self.key_memo), inst.definition, new_entries)
+            entry = {'kind': 'custom', 'gate': 'gate' if isinstance(inst, Gate) else 'instruction',
+                     'name': inst.name, 'num_qubits': inst.num_qubits, 'num_clbits': inst.num_clbits,
+                     'num_params': len(inst.params), 'definition': definition}
+            key = json.dumps(entry, sort_keys=True)
+
+        if key not in self.entry_index:
+            self.entry_index[key] = len(self.entries)
+            new_entries.append([len(self.entries), entry])
+            self.entries.append(entry)
+        self.memo[id(inst)] = (inst, self.entry_index[key])
+
+        return self.entry_index[key]
+
+    def records(self, qc, kind=b'D'):
+        # Generator of (kind, header, arrays) of the definitions qc needs and
+        # of qc itself
+        qubit_index = {q: i for i, q in enumerate(qc.qubits)}
+        clbit_index = {c: i for i, c in enumerate(qc.clbits)}
+
+        ops, qargs, cargs, params, conditions = [], [], [], [], []
+        # [table index, entry] of the entries first used here and not yet
+        # written with a definition before
+        entries = []
+        for n, (inst, qubits, clbits) in enumerate(qc.data):
+            if inst.params:
+                params.extend(_float_params(inst))
+            ops.append((yield from self.entry(inst, entries)))
+
+            qargs.extend(qubit_index[q] for q in qubits)
+            cargs.extend(clbit_index[c] for c in clbits)
+
+            condition = getattr(inst, 'condition', None)
+            if condition is not None:
+                target, value = condition
+                if isinstance(target, ClassicalRegister):
+                    conditions.append([n, target.name, None, value])
+                else:
+                    conditions.append([n, None, clbit_index[target], value])
+
+        arrays = {
+            'ops': np.array(ops, dtype=_index_dtype(len(self.entries))),
+            'qargs': np.array(qargs, dtype=_index_dtype(qc.num_qubits)),
+            'cargs': np.array(cargs, dtype=_index_dtype(qc.num_clbits)),
+            'params': np.array(params, dtype=np.float64),
+        }
+        header = {
+            'entries': entries,
+            'name': qc.name,
+            'num_qubits': qc.num_qubits,
+            'num_clbits': qc.num_clbits,
+            'global_phase': float(qc.global_phase),
+            'qregs': [[r.name, 'ancilla' if isinstance(r, AncillaRegister) else 'quantum',
+                       [qubit_index[q] for q in r]] for r in qc.qregs],
+            'cregs': [[r.name, [clbit_index[c] for c in r]] for r in qc.cregs],
+            'conditions': conditions,
+        }
+        yield kind, header, arrays
+
+
+def _records(qc):
+    return _Writer().records(qc, b'C')
+
+
+def _padding(position):
+    return -position % 8
+
+
+def dump(qc, f):
+    # Writes the records one by one to the binary file object f
+    f.write(MAGIC)
+    position = len(MAGIC)
+
+    for kind, header, arrays in _records(qc):
+        header = dict(header, arrays=[[name, array.dtype.str, len(array)] for name, array in arrays.items()])
+        data = json.dumps(header, separators=(',', ':')).encode()
+
+        f.write(_RECORD.pack(kind, len(data)))
+        f.write(data)
+        position += _RECORD.size + len(data)
+        f.write(b'\0' * _padding(position))
+        position += _padding(position)
+
+        for array in arrays.values():
+            f.write(memoryview(np.ascontiguousarray(array)).cast('B'))
+            position += array.nbytes
+            f.write(b'\0' * _padding(position))
+            position += _padding(position)
+
+
+def dumps(qc):
+    f = io.BytesIO()
+    dump(qc, f)
+    return f.getvalue()
+
+
+def _read_records(read):
+    # read(n) returns the next n bytes as a buffer, arrays are views into it
+    def read_exactly(n):
+        chunk = read(n)
+        if len(chunk) < n:
+            raise ValueError("Serialized circuit is truncated")
+        return chunk
+
+    if bytes(read(len(MAGIC))) != MAGIC:
+        raise ValueError("Not a serialized circuit")
+    position = len(MAGIC)
+
+    while True:
+        start = read(_RECORD.size)
+        if not len(start):
+            return
+        if len(start) < _RECORD.size:
+            raise ValueError("Serialized circuit is truncated")
+        kind, length = _RECORD.unpack(start)
+        try:
+            header = json.loads(bytes(read_exactly(length)))
+        except json.JSONDecodeError:
+            raise ValueError("Serialized circuit is corrupt") from None
+        position += _RECORD.size + length
+        read_exactly(_padding(position))
+        position += _padding(position)
+
+        arrays = {}
+        for name, dtype, count in header.pop('arrays'):
+            dtype = np.dtype(dtype)
+            arrays[name] = np.frombuffer(read_exactly(count * dtype.itemsize), dtype=dtype, count=count)
+            position += count * dtype.itemsize
+            read_exactly(_padding(position))
+            position += _padding(position)
+
+        yield kind, header, arrays
+
+
+def _buffer_reader(buffer):
+    view = memoryview(buffer)
+    offset = 0
+
+    def read(n):
+        nonlocal offset
+        chunk = view[offset:offset + n]
+        offset += len(chunk)
+        return chunk
+
+    return read
+
+
+def load_arrays(buffer):
+    # Header and array views of the circuit record without building circuits,
+    # for counting and diffing
+    records = list(_read_records(_buffer_reader(buffer)))
+    table = dict(entry for _, header, _ in records for entry in header['entries'])
+    _, header, arrays = records[-1]
+
+    return dict(header, table=[table[i] for i in range(len(table))], **arrays)
+
+
+class _Reader:
+    def __init__(self):
+        self.entries = {}
+        self.arities = np.zeros((0, 3), dtype=np.int64)
+        self.definitions = []
+        # (entry, params) -> instruction, equal instructions share one object
+        self.instructions = {}
+
+    def instruction(self, index, params):
+        key = (index, params)
+        if key not in self.instructions:
+            entry = self.entries[index]
+            if entry['kind'] == 'library':
+                inst = _build_library_gate(entry, params)
+            elif entry['kind'] == 'controlled':
+                inst = ControlledGate(entry['name'], entry['num_qubits'], list(params),
+                                      num_ctrl_qubits=entry['num_ctrl_qubits'],
+                                      definition=self.definitions[entry['definition']],
+                                      ctrl_state=entry['ctrl_state'], base_gate=self.instruction(entry['base'], params))
+            elif entry['gate'] == 'gate':
+                inst = Gate(entry['name'], entry['num_qubits'], list(params))
+                inst.definition = self.definitions[entry['definition']]
+            else:
+                inst = Instruction(entry['name'], entry['num_qubits'], entry['num_clbits'], list(params))
+                inst.definition = self.definitions[entry['definition']]
+            self.instructions[key] = inst
+
+        return self.instructions[key]
+
+    def table(self, entries):
+        for index, entry in entries:
+            self.entries[index] = entry
+        if entries:
+            self.arities = np.zeros((max(self.entries) + 1, 3), dtype=np.int64)
+            for index, entry in self.entries.items():
+                self.arities[index] = entry['num_qubits'], entry['num_clbits'], entry['num_params']
+
+    def circuit(self, header, arrays):
+        self.table(header['entries'])
+
+        qubits = [None] * header['num_qubits']
+        clbits = [None] * header['num_clbits']
+        qregs, cregs = [], {}
+        for name, kind, indices in header['qregs']:
+            register = (AncillaRegister if kind == 'ancilla' else QuantumRegister)(len(indices), name)
+            for bit, i in zip(register, indices):
+                qubits[i] = bit
+            qregs.append(register)
+        for name, indices in header['cregs']:
+            register = ClassicalRegister(len(indices), name)
+            for bit, i in zip(register, indices):
+                clbits[i] = bit
+            cregs[name] = register
+        qubits = [bit if bit is not None else Qubit() for bit in qubits]
+        clbits = [bit if bit is not None else Clbit() for bit in clbits]
+
+        qc = QuantumCircuit(qubits, clbits, *qregs, *cregs.values(), name=header['name'],
+                            global_phase=header['global_phase'])
+
+        # Arity of every instruction from its table entry, offsets into the
+        # flat arrays by cumulative sums
+        ops = arrays['ops']
+        arities = self.arities[ops]
+        ends = np.cumsum(arities, axis=0)
+        starts = ends - arities
+
+        qargs, cargs, params = arrays['qargs'].tolist(), arrays['cargs'].tolist(), arrays['params'].tolist()
+        conditions = {n: (register, bit, value) for n, register, bit, value in header['conditions']}
+
+        for n, (index, (q0, c0, p0), (q1, c1, p1)) in enumerate(zip(ops.tolist(), starts.tolist(), ends.tolist())):
+            inst = self.instruction(index, tuple(params[p0:p1]))
+            if n in conditions:
+                register, bit, value = conditions[n]
+                inst = inst.to_mutable() if hasattr(inst, 'to_mutable') else inst.copy()
+                inst.condition = (cregs[register] if register is not None else clbits[bit], value)
+            qc._append(inst, [qubits[i] for i in qargs[q0:q1]], [clbits[i] for i in cargs[c0:c1]])
+
+        return qc
+
+    def read(self, records):
+        for kind, header, arrays in records:
+            if kind == b'T':
+                self.table(header['entries'])
+                continue
+            qc = self.circuit(header, arrays)
+            if kind == b'C':
+                return qc
+            self.definitions.append(qc)
+
+        raise ValueError("Serialized circuit is truncated")
+
+
+def load(f):
+    # Reads the records one by one from the binary file object f
+    return _Reader().read(_read_records(f.read))
+
+
+def loads(buffer):
+    return _Reader().read(_read_records(_buffer_reader(buffer)))
+
+
+def load_file(path):
+    # Memory maps the file, the arrays are views into the mapping
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return loads(buffer)
+
+
+def to_dict(qc):
+    # JSON-compatible form of the same records
+    return {'format': MAGIC[:3].decode(), 'version': MAGIC[3],
+            'records': [dict(header, kind=kind.decode(), **{name: array.tolist() for name, array in arrays.items()})
+                        for kind, header, arrays in _records(qc)]}
+
+
+def from_dict(data):
+    records = []
+    for record in data['records']:
+        record = dict(record)
+        arrays = {name: np.asarray(record.pop(name, []), dtype=np.float64 if name == 'params' else np.int64)
+                  for name in ['ops', 'qargs', 'cargs', 'params']}
+        records.append((record.pop('kind').encode(), record, arrays))
+
+    return _Reader().read(records)
+
+
+if __name__ == "__main__":
+    import time
+
+    from week2b import week2b_ans_func
+    from week3 import week3_ans_func
+    from utils.board_tools import board2_bitstrings
+    from utils.grader_utils import circuit_to_json
+    from datasets.data import problem_set
+
+    lightsout4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+                  [1, 0, 1, 0, 0, 0, 1, 1, 0],
+                  [1, 0, 1, 1, 1, 1, 0, 0, 1],
+                  [1, 0, 0, 0, 0, 0, 1, 0, 0]
+                  ]
+
+    def timed(func):
+        start = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - start
+
+    for name, qc in [("week2b", week2b_ans_func(lightsout4)),
+                     ("week3", week3_ans_func(board2_bitstrings(problem_set)))]:
+        text, json_time = timed(lambda: circuit_to_json(qc))
+        data, dump_time = timed(lambda: dumps(qc))
+        loaded, load_time = timed(lambda: loads(data))
+        assert loaded == qc
+
+        print(f"{name}: circuit_to_json {len(text):>9} bytes {json_time:.3f}s\t"
+              f"dumps {len(data):>8} bytes {dump_time:.3f}s\tloads {load_time:.3f}s")
@@ -0,0 +1,161 @@
+import json
+import numpy as np
+
+from qiskit import QuantumCircuit
+from qiskit.circuit import Barrier, Gate, Instruction, Measure
+from qiskit.circuit.library import UGate, U3Gate, CXGate
+
+from utils.cost_model import gate_key
+
+
+# Cost model of the grader (utils.cost_model): U/U3 cost 1, CX cost 10, everything else is
+# charged for its definition. Next to the cost every gate gets its CX count,
+# its single qubit gate count and a latency matrix over its qubits: entry
+# (i, j) is the longest U/CX path from input qubit i to output qubit j (or
+# -inf). Chaining these matrices gives the exact depth of the decomposed
+# circuit without flattening it.
+
+def _identity_latency(num_qubits):
+    latency = np.full((num_qubits, num_qubits), -np.inf)
+    np.fill_diagonal(latency, 0)
+    return latency
+
+
+def _chain(latency, qubits, gate_latency):
+    # latency[:, qubits] <- max_k latency[:, qubits[k]] + gate_latency[k, :]
+    latency[:, qubits] = (latency[:, qubits][:, :, np.newaxis] + gate_latency[np.newaxis, :, :]).max(axis=1)
+
+
+def _depth(latency):
+    return int(max(latency.max(), 0))
+
+
+def _sequence_stats(data, qubit_index, num_qubits, memo, keys):
+    stats = {'cost': 0, 'cx': 0, 'single_qubit': 0}
+    latency = _identity_latency(num_qubits)
+
+    for inst, qargs, _ in data:
+        inst_stats = _gate_stats(inst, memo, keys)
+        for metric in stats:
+            stats[metric] += inst_stats[metric]
+        _chain(latency, [qubit_index[q] for q in qargs], inst_stats['latency'])
+
+    stats['latency'] = latency
+    return stats
+
+
+def _gate_stats(gate, memo, keys):
+    if isinstance(gate, (UGate, U3Gate)):
+        return {'cost': 1, 'cx': 0, 'single_qubit': 1, 'latency': np.ones((1, 1))}
+    elif isinstance(gate, CXGate):
+        return {'cost': 10, 'cx': 1, 'single_qubit': 0, 'latency': np.ones((2, 2))}
+    elif isinstance(gate, (Measure, Barrier)):
+        return {'cost': 0, 'cx': 0, 'single_qubit': 0, 'latency': _identity_latency(gate.num_qubits)}
+
+    key = gate_key(gate, keys)
+    if key not in memo:
+        definition = gate.definition
+        qubit_index = {q: i for i, q in enumerate(definition.qubits)}
+        memo[key] = _sequence_stats(definition.data, qubit_index, gate.num_qubits, memo, keys)
+
+    return memo[key]
+
+
+def _node(name, stats, count=1):
+    return {
+        'name': name,
+        'count': count,
+        'cost': count * stats['cost'],
+        'cx': count * stats['cx'],
+        'single_qubit': count * stats['single_qubit'],
+        'depth': _depth(stats['latency']),
+        'children': []
+    }
+
+
+def _children(data, memo, keys):
+    # Equal gates are merged into one node with a count, the first occurrence
+    # fixes the order
+    groups = {}
+    for inst, _, _ in data:
+        if isinstance(inst, Barrier):
+            continue
+        key = gate_key(inst, keys)
+        if key in groups:
+            groups[key][1] += 1
+        else:
+            groups[key] = [inst, 1]
+
+    nodes = []
+    for inst, count in groups.values():
+        node = _node(inst.name, _gate_stats(inst, memo, keys), count)
+        # Only custom blocks (QuantumCircuit.to_gate) are expanded, library
+        # gates stay leaves
+        if type(inst) in (Gate, Instruction) and inst.definition is not None:
+            node['children'] = _children(inst.definition.data, memo, keys)
+        nodes.append(node)
+
+    return nodes
+
+
+def profile_circuit(circuit, region_names=None, name='circuit'):
+    if isinstance(circuit, Instruction):
+        circuit = circuit.definition
+
+    memo = {}
+    keys = {}
+    qubit_index = {q: i for i, q in enumerate(circuit.qubits)}
+
+    # Barriers split the circuit into regions
+    regions = [[]]
+    for inst, qargs, cargs in circuit.data:
+        if isinstance(inst, Barrier):
+            if regions[-1]:
+                regions.append([])
+            continue
+        regions[-1].append((inst, qargs, cargs))
+    regions = [r for r in regions if r]
+
+    if region_names is None:
+        region_names = [f"region {n}" for n in range(len(regions))]
+    elif len(region_names) != len(regions):
+        raise ValueError(f"Got {len(region_names)} region names for {len(regions)} regions")
+
+    root = _node(name, _sequence_stats(circuit.data, qubit_index, circuit.num_qubits, memo, keys))
+    for region_name, region in zip(region_names, regions):
+        node = _node(region_name, _sequence_stats(region, qubit_index, circuit.num_qubits, memo, keys))
+        node['children'] = _children(region, memo, keys)
+        root['children'].append(node)
+
+    return root
+
+
+def format_profile(profile, max_level=None):
+    lines = [f"{'block':<40}{'count':>7}{'cost':>10}{'share':>8}{'CX':>9}{'1Q':>9}{'depth':>9}"]
+    total = max(profile['cost'], 1)
+
+    def add(node, level):
+        label = '  ' * level + node['name']
+        lines.append(f"{label:<40}{node['count']:>7}{node['cost']:>10}{100 * node['cost'] / total:>7.1f}%"
+                     f"{node['cx']:>9}{node['single_qubit']:>9}{node['depth']:>9}")
+        if max_level is None or level < max_level:
+            for child in node['children']:
+                add(child, level + 1)
+
+    add(profile, 0)
+    return "\n".join(lines)
+
+
+def profile_to_json(profile):
+    return json.dumps(profile)
+
+
+if __name__ == "__main__":
+    from circuit_parts.adder import counter_9bit_gate
+
+    qc = QuantumCircuit(16)
+    qc.append(counter_9bit_gate(), range(16))
+    qc.barrier()
+    qc.append(counter_9bit_gate().inverse(), range(16))
+
+    print(format_profile(profile_circuit(qc, ["counter", "uncompute"])))
@@ -0,0 +1,112 @@
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+from qiskit import QuantumCircuit, Aer
+
+from utils.transpile_cache import transpile_circuits, get_transpile_cache
+
+
+# One place to run circuits. All circuits of a call go to Aer as one batched
+# job (Aer parallelizes over experiments itself), or are split into chunks
+# that run in worker processes. Shots, seeds and simulator threading are set
+# here instead of at every call site. Circuits are transpiled through the
+# transpile cache if one is enabled, so runs that only change shots or seeds
+# skip the compilation.
+
+DEFAULT_SHOTS = 1000
+
+
+def _run_aer(circuits, shots, seed_simulator, backend_name, max_parallel_threads, max_parallel_experiments,
+             optimization_level=1, transpile_cache=None):
+    backend = Aer.get_backend(backend_name)
+    circuits = transpile_circuits(circuits, backend, optimization_level, cache=transpile_cache)
+    job = backend.run(circuits, shots=shots, seed_simulator=seed_simulator,
+                      max_parallel_threads=max_parallel_threads,
+                      max_parallel_experiments=max_parallel_experiments)
+    result = job.result()
+
+    return [result.get_counts(n) for n in range(len(circuits))]
+
+
+def _run_sparse(circuits, shots, seed_simulator):
+    from utils.sparse_sim import run_sparse
+
+    return [run_sparse(qc, shots=shots, seed_simulator=None if seed_simulator is None else seed_simulator + n)
+            for n, qc in enumerate(circuits)]
+
+
+def _run_chunk(args):
+    (circuits, shots, seed_simulator, method, backend_name, max_parallel_threads,
+     optimization_level, transpile_cache) = args
+    if method == 'sparse':
+        return _run_sparse(circuits, shots, seed_simulator)
+    return _run_aer(circuits, shots, seed_simulator, backend_name, max_parallel_threads, 1,
+                    optimization_level, transpile_cache)
+
+
+def sort_counts(count, max_k=None):
+    # (outcome, counts) pairs, most frequent first, ties by outcome
+    ordered = sorted(count.items(), key=lambda item: (-item[1], item[0]))
+    return ordered if max_k is None else ordered[:max_k]
+
+
+def decode_address(outcome):
+    # Outcome string of the address register as printed by get_counts (qubit 0
+    # rightmost) to the address index of write_qram (qubit 0 is the MSB)
+    return int(outcome.replace(' ', '')[::-1], 2)
+
+
+def run_circuits(circuits, shots=DEFAULT_SHOTS, seed_simulator=None, method='aer', processes=None,
+                 backend_name='qasm_simulator', max_parallel_threads=0, max_parallel_experiments=0,
+                 optimization_level=1, transpile_cache=None):
+    # Returns the sorted counts of every circuit. With processes > 1 the
+    # circuits are split into that many chunks, chunk i is seeded with
+    # seed_simulator + its first circuit index and every worker runs Aer
+    # single threaded unless max_parallel_threads says otherwise.
+    # transpile_cache None uses the cache of enable_transpile_cache, the
+    # workers get it passed along.
+    if isinstance(circuits, QuantumCircuit):
+        circuits = [circuits]
+    circuits = list(circuits)
+
+    if method not in ('aer', 'sparse'):
+        raise ValueError(f"Unknown simulation method {method}, use 'aer' or 'sparse'")
+
+    if not circuits:
+        return []
+
+    if processes is None or processes <= 1:
+        if method == 'sparse':
+            counts = _run_sparse(circuits, shots, seed_simulator)
+        else:
+            counts = _run_aer(circuits, shots, seed_simulator, backend_name,
+                              max_parallel_threads, max_parallel_experiments, optimization_level, transpile_cache)
+    else:
+        if transpile_cache is None:
+            transpile_cache = get_transpile_cache()
+        chunk_size = -(-len(circuits) // processes)
+        starts = range(0, len(circuits), chunk_size)
+        chunks = [(circuits[start:start + chunk_size], shots,
+                   None if seed_simulator is None else seed_simulator + start,
+                   method, backend_name, max_parallel_threads or 1, optimization_level, transpile_cache)
+                  for start in starts]
+
+        # Forking a process that already ran Aer can deadlock in its OpenMP
+        # runtime, workers are spawned instead
+        with ProcessPoolExecutor(max_workers=len(chunks), mp_context=multiprocessing.get_context('spawn')) as pool:
+            counts = [count for chunk in pool.map(_run_chunk, chunks) for count in chunk]
+
+    return [sort_counts(count) for count in counts]
+
+
+def run_circuit(circuit, shots=DEFAULT_SHOTS, seed_simulator=None, method='aer', **kwargs):
+    return run_circuits([circuit], shots, seed_simulator, method, **kwargs)[0]
+
+
+def print_counts(counts, max_k=None, label="Solution", decode=False):
+    for k, count in counts[:max_k]:
+        if decode:
+            print(f"{label}: {k} (Board {decode_address(k)})\tCounts: {count}")
+        else:
+            print(f"{label}: {k}\tCounts: {count}")
@@ -9,10 +9,12 @@ from typing import Any, Callable, Optional, Tuple, Union
 
 from qiskit import IBMQ, QuantumCircuit, assemble
 from qiskit.circuit import Barrier, Gate, Instruction, Measure
-from qiskit.circuit.library import UGate, U3Gate, CXGate
 from qiskit.providers.ibmq import AccountProvider, IBMQProviderError
 from qiskit.providers.ibmq.job import IBMQJob
 
+from utils.cost_model import (CostCache, enable_persistent_cost_cache, gate_key, gate_cost, compute_cost,
+                              _cost_cache)
+
 
 def get_provider() -> AccountProvider:
     with warnings.catch_warnings():
@@ -82,34 +84,6 @@ def cached(key_function: Callable) -> Callable:
     return _decorator
 
 
-def gate_key(gate: Gate) -> Tuple[str, int]:
-    return gate.name, gate.num_qubits
-
-
-@cached(gate_key)
-def gate_cost(gate: Gate) -> int:
-    if isinstance(gate, (UGate, U3Gate)):
-        return 1
-    elif isinstance(gate, CXGate):
-        return 10
-    elif isinstance(gate, (Measure, Barrier)):
-        return 0
-    return sum(map(gate_cost, (g for g, _, _ in gate.definition.data)))
-
-
-def compute_cost(circuit: Union[Instruction, QuantumCircuit]) -> int:
-    print('Computing cost...')
-    circuit_data = None
-    if isinstance(circuit, QuantumCircuit):
-        circuit_data = circuit.data
-    elif isinstance(circuit, Instruction):
-        circuit_data = circuit.definition.data
-    else:
-        raise Exception(f'Unable to obtain circuit data from {type(circuit)}')
-
-    return sum(map(gate_cost, (g for g, _, _ in circuit_data)))
-
-
 def uses_multiqubit_gate(circuit: QuantumCircuit) -> bool:
     circuit_data = None
     if isinstance(circuit, QuantumCircuit):
@@ -0,0 +1,158 @@
+import numpy as np
+
+from math import asin, comb, pi, sqrt
+
+from utils.lights_out_solver import all_lights_out_solutions
+from utils.asteroid_solver import beam_checker_parity
+
+
+# Exact Grover amplitudes without simulation. All operators used by the
+# pipelines are phase flips on sets of basis states and the diffuser
+# I - 2|s><s|, so amplitudes stay uniform on every set of states that no
+# operator tells apart ("atoms"). The state is tracked as one amplitude per
+# atom, which takes a few vectors of the size of the marked sets.
+
+def _diffuse(amps, sizes, num_states):
+    # I - 2|s><s| on the uniform superposition over num_states states
+    return amps - 2 * np.dot(sizes, amps) / num_states
+
+
+def grover_amplitudes(num_items, num_marked, num_iterations):
+    # Amplitude of every marked and every unmarked item after num_iterations
+    # oracle + diffuser steps, starting from the uniform superposition
+    sizes = np.array([num_marked, num_items - num_marked], dtype=float)
+    amps = np.full(2, 1 / sqrt(num_items))
+
+    for _ in range(num_iterations):
+        amps[0] = -amps[0]
+        amps = _diffuse(amps, sizes, num_items)
+
+    return amps[0], amps[1]
+
+
+def grover_success(num_items, num_marked, num_iterations):
+    # Probability to measure any marked item
+    amp_marked, _ = grover_amplitudes(num_items, num_marked, num_iterations)
+    return float(num_marked * amp_marked ** 2)
+
+
+def grover_probabilities(num_items, marked, num_iterations):
+    marked = np.isin(np.arange(num_items), marked)
+    amp_marked, amp_unmarked = grover_amplitudes(num_items, int(marked.sum()), num_iterations)
+
+    return np.where(marked, amp_marked, amp_unmarked) ** 2
+
+
+def optimal_iterations(num_items, num_marked):
+    if num_marked == 0 or num_marked == num_items:
+        return 0
+
+    theta = asin(sqrt(num_marked / num_items))
+    candidates = {max(0, int(pi / (4 * theta) - 0.5)), int(pi / (4 * theta) - 0.5) + 1}
+
+    return max(sorted(candidates), key=lambda k: np.sin((2 * k + 1) * theta) ** 2)
+
+
+def _inner_states(marked_sets, num_states, num_iterations, in_filter, filter_size):
+    # Switch register state of every address after
+    # (oracle, diffuser)^k, filter phase flip, (oracle, diffuser)^k
+    special = sorted(set().union(*marked_sets))
+    special_in_filter = np.array([in_filter(s) for s in special], dtype=bool)
+
+    # Atoms: every state of a marked set on its own, then the remaining states
+    # inside and outside of the filter
+    sizes = np.concatenate([np.ones(len(special)),
+                            [filter_size - special_in_filter.sum(),
+                             num_states - len(special) - (filter_size - special_in_filter.sum())]])
+    filter_atoms = np.concatenate([special_in_filter, [True, False]])
+    position = {s: n for n, s in enumerate(special)}
+
+    states = []
+    for marked in marked_sets:
+        marked_atoms = np.zeros(len(sizes), dtype=bool)
+        marked_atoms[[position[m] for m in marked]] = True
+
+        amps = np.full(len(sizes), 1 / sqrt(num_states), dtype=complex)
+        for _ in range(num_iterations):
+            amps[marked_atoms] *= -1
+            amps = _diffuse(amps, sizes, num_states)
+
+        amps[filter_atoms] *= -1
+
+        for _ in range(num_iterations):
+            amps[marked_atoms] *= -1
+            amps = _diffuse(amps, sizes, num_states)
+
+        states.append(amps)
+
+    return np.array(states), sizes
+
+
+def nested_grover_probabilities(marked_sets, num_states, num_iterations, in_filter, filter_size):
+    # Address register in uniform superposition, per address a Grover search on
+    # the inner register for marked_sets[a] as built by week2b_ans_func,
+    # followed by the diffuser on the address register. Returns the
+    # probability to measure each address.
+    states, sizes = _inner_states(marked_sets, num_states, num_iterations, in_filter, filter_size)
+    num_addresses = len(marked_sets)
+
+    # Gram matrix <phi_a|phi_b> of the inner states
+    overlaps = (states.conj() * sizes) @ states.T
+
+    # After the diffuser address b carries (phi_b - 2/A sum_a phi_a) / sqrt(A)
+    total = overlaps.sum()
+    probs = (np.diag(overlaps) - 4 / num_addresses * overlaps.sum(axis=1) + 4 / num_addresses ** 2 * total)
+
+    return probs.real / num_addresses
+
+
+def lights_out_address_probabilities(boards, max_switches=3, num_iterations=17):
+    num_lights = len(boards[0])
+    marked_sets = [all_lights_out_solutions(board) for board in boards]
+    filter_size = sum(comb(num_lights, k) for k in range(max_switches + 1))
+
+    return nested_grover_probabilities(marked_sets, 2 ** num_lights, num_iterations,
+                                       lambda s: bin(s).count('1') <= max_switches, filter_size)
+
+
+def recommend_lights_out_iterations(boards, max_switches=3, max_iterations=40):
+    # Iteration count that maximizes the probability of the addresses whose
+    # board has a solution within max_switches
+    targets = [n for n, board in enumerate(boards)
+               if any(bin(s).count('1') <= max_switches for s in all_lights_out_solutions(board))]
+
+    success = np.array([lights_out_address_probabilities(boards, max_switches, k)[targets].sum()
+                        for k in range(max_iterations + 1)])
+
+    return int(success.argmax()), success
+
+
+def asteroid_address_probabilities(boards, num_iterations=1, board_size=4):
+    # week3_ans_func: one oracle marks the addresses whose board makes
+    # beam_checker fire, followed by the address diffuser
+    marked = np.flatnonzero(beam_checker_parity(boards, board_size))
+    return grover_probabilities(len(boards), marked, num_iterations)
+
+
+def recommend_asteroid_iterations(boards, board_size=4):
+    num_marked = int(beam_checker_parity(boards, board_size).sum())
+    return optimal_iterations(len(boards), num_marked)
+
+
+if __name__ == "__main__":
+    from utils.board_tools import board2_bitstrings
+    from datasets.data import problem_set
+
+    lightsout4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+                  [1, 0, 1, 0, 0, 0, 1, 1, 0],
+                  [1, 0, 1, 1, 1, 1, 0, 0, 1],
+                  [1, 0, 0, 0, 0, 0, 1, 0, 0]
+                  ]
+
+    print(f"week2b address probabilities: {lights_out_address_probabilities(lightsout4).round(4)}")
+    best, success = recommend_lights_out_iterations(lightsout4)
+    print(f"Best inner iterations: {best}\tSuccess: {success[best]:.4f}\t(17 iterations: {success[17]:.4f})")
+
+    boards = board2_bitstrings(problem_set)
+    print(f"week3 address probabilities: {asteroid_address_probabilities(boards).round(4)}")
+    print(f"Best iterations: {recommend_asteroid_iterations(boards)}")
@@ -0,0 +1,121 @@
+import numpy as np
+
+from math import sqrt
+
+from utils.asteroid_solver import beam_checker_parity
+from utils.lights_out_solver import all_lights_out_solutions
+from utils.grover_analytics import grover_success, optimal_iterations, lights_out_address_probabilities
+from utils.cost_model import circuit_cost
+
+
+# Iteration counts from classically counted marked states. Every candidate
+# count k of an amplification layer gets its success probability (exact, from
+# the marked counts) and its cost under the compute_cost model, which is
+# linear in k for all pipelines. The planner then picks the count by one of
+#   'cost_per_success'  cheapest cost per unit of success probability above
+#                       guessing (the success of 0 iterations)
+#   'success'           highest success probability
+#   'min_cost'          cheapest count with success >= min_success
+
+OBJECTIVES = ('cost_per_success', 'success', 'min_cost')
+
+
+def linear_cost(builder):
+    # (base, per iteration) of the cost of builder(k), from k = 1 and k = 2
+    c1, c2 = circuit_cost(builder(1)), circuit_cost(builder(2))
+    return c1 - (c2 - c1), c2 - c1
+
+
+def choose_iterations(table, objective='cost_per_success', min_success=0.9, prior=0.0):
+    # table: list of (iterations, success, cost), prior is the success of
+    # guessing
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective}, use one of {', '.join(OBJECTIVES)}")
+
+    if objective == 'success':
+        return max(table, key=lambda row: (row[1], -row[2]))
+    elif objective == 'min_cost':
+        feasible = [row for row in table if row[1] >= min_success]
+        if not feasible:
+            return max(table, key=lambda row: (row[1], -row[2]))
+        return min(feasible, key=lambda row: row[2])
+
+    return min(table, key=lambda row: row[2] / (row[1] - prior) if row[1] > prior else np.inf)
+
+
+def _plan(table, objective, min_success, prior, **info):
+    iterations, success, cost = choose_iterations(table, objective, min_success, prior)
+    return dict(info, iterations=iterations, success=success, cost=cost, prior=prior, table=table)
+
+
+def plan_asteroid_iterations(boards, board_size=4, objective='cost_per_success', min_success=0.9, max_iterations=None):
+    # Outer layer of week3_ans_func: the oracle marks the addresses whose board
+    # makes beam_checker fire
+    from week3 import week3_ans_func
+
+    num_items = len(boards)
+    num_marked = int(beam_checker_parity(boards, board_size).sum())
+    base, per_iteration = linear_cost(lambda k: week3_ans_func(boards, num_iterations=k, optimize=False))
+
+    if max_iterations is None:
+        max_iterations = max(1, int(np.ceil(np.pi / 4 * sqrt(num_items))))
+
+    table = [(k, grover_success(num_items, num_marked, k), base + k * per_iteration)
+             for k in range(1, max_iterations + 1)]
+
+    return _plan(table, objective, min_success, num_marked / num_items,
+                 layer='address', num_items=num_items, num_marked=num_marked)
+
+
+def plan_lights_out_iterations(boards, max_switches=3, objective='cost_per_success', min_success=0.9,
+                               candidates=None):
+    # Inner layer of the Lights Out pipeline, the search over the switches. Its
+    # success is the probability to measure an address whose board has a
+    # solution within max_switches after the single address reflection.
+    from lights_out_pipeline import plan_lights_out_pipeline
+
+    solutions = [all_lights_out_solutions(board) for board in boards]
+    targets = [n for n, s in enumerate(solutions) if any(bin(v).count('1') <= max_switches for v in s)]
+    num_lights = len(boards[0])
+    num_solutions = max(len(s) for s in solutions)
+    base_iterations = optimal_iterations(2 ** num_lights, num_solutions) if num_solutions else 1
+
+    if candidates is None:
+        # The exact success of k costs O(k), so large searches only look near
+        # the Grover optimum
+        if base_iterations <= 64:
+            candidates = range(1, 2 * base_iterations + 1)
+        else:
+            candidates = range(base_iterations - 3, base_iterations + 4)
+
+    c1 = plan_lights_out_pipeline(boards, max_switches, 1)['cost']
+    per_iteration = plan_lights_out_pipeline(boards, max_switches, 2)['cost'] - c1
+
+    table = []
+    for k in candidates:
+        success = float(lights_out_address_probabilities(boards, max_switches, k)[targets].sum()) if targets else 0.0
+        table.append((k, success, c1 + (k - 1) * per_iteration))
+
+    return _plan(table, objective, min_success, len(targets) / len(boards),
+                 layer='switch', num_items=2 ** num_lights, num_marked=[len(s) for s in solutions], targets=targets)
+
+
+def format_plan(plan):
+    return (f"{plan['layer']} layer: {plan['iterations']} iterations\tsuccess: {plan['success']:.4f}"
+            f" (guessing {plan['prior']:.4f})\tcost: {plan['cost']}")
+
+
+if __name__ == "__main__":
+    from utils.board_tools import board2_bitstrings
+    from datasets.data import problem_set
+
+    lightsout4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+                  [1, 0, 1, 0, 0, 0, 1, 1, 0],
+                  [1, 0, 1, 1, 1, 1, 0, 0, 1],
+                  [1, 0, 0, 0, 0, 0, 1, 0, 0]
+                  ]
+
+    for objective in OBJECTIVES:
+        print(f"{objective}:")
+        print(format_plan(plan_lights_out_iterations(lightsout4, objective=objective)))
+        print(format_plan(plan_asteroid_iterations(board2_bitstrings(problem_set), objective=objective)))
@@ -0,0 +1,156 @@
+import numpy as np
+
+from functools import lru_cache
+
+from utils.board_tools import compute_switch_edges, popcount
+
+
+# Pressing switch j toggles every light in compute_switch_edges()[j], so a
+# board is solved by the switch vector s with A s = lights over GF(2). Rows of
+# A are packed into Python ints, bit j of row i is set if switch j toggles
+# light i.
+
+def toggle_matrix(board_size=3):
+    rows = [0] * board_size ** 2
+    for source, targets in compute_switch_edges(board_size).items():
+        for target in targets:
+            rows[target] |= 1 << source
+
+    return rows
+
+
+def gf2_eliminate(rows, num_cols):
+    # Gauss-Jordan elimination on packed rows. The row operations are recorded
+    # in transform, so that transform * A = reduced.
+    reduced = list(rows)
+    transform = [1 << i for i in range(len(rows))]
+    pivots = []
+
+    rank = 0
+    for col in range(num_cols):
+        pivot = next((r for r in range(rank, len(reduced)) if reduced[r] >> col & 1), None)
+        if pivot is None:
+            continue
+
+        reduced[rank], reduced[pivot] = reduced[pivot], reduced[rank]
+        transform[rank], transform[pivot] = transform[pivot], transform[rank]
+
+        for r in range(len(reduced)):
+            if r != rank and reduced[r] >> col & 1:
+                reduced[r] ^= reduced[rank]
+                transform[r] ^= transform[rank]
+
+        pivots.append(col)
+        rank += 1
+
+    return pivots, reduced, transform
+
+
+def unpack_rows(rows, num_cols):
+    rows = np.array(rows, dtype=object).reshape(-1, 1)
+    return ((rows >> np.arange(num_cols)) & 1).astype(np.uint8)
+
+
+@lru_cache(maxsize=8)
+def lights_out_system(board_size=3):
+    num_lights = board_size ** 2
+    pivots, reduced, transform = gf2_eliminate(toggle_matrix(board_size), num_lights)
+    rank = len(pivots)
+
+    # Null space of A, one vector per free switch
+    free = [col for col in range(num_lights) if col not in pivots]
+    null_basis = []
+    for f in free:
+        vector = 1 << f
+        for row, p in enumerate(pivots):
+            if reduced[row] >> f & 1:
+                vector |= 1 << p
+        null_basis.append(vector)
+
+    # All 2^k elements of the null space as packed bit arrays
+    null_space = [0]
+    for vector in null_basis:
+        null_space += [v ^ vector for v in null_space]
+
+    transform = unpack_rows(transform, num_lights)
+    null_space = np.packbits(unpack_rows(null_space, num_lights), axis=1, bitorder='little')
+
+    return pivots, transform[:rank], transform[rank:], null_basis, null_space
+
+
+def solve_lights_out_batch(lights, board_size=None):
+    lights = np.atleast_2d(np.asarray(lights, dtype=np.uint8))
+    num_lights = lights.shape[1]
+    if board_size is None:
+        board_size = int(np.sqrt(num_lights))
+
+    pivots, transform, left_null, _, null_space = lights_out_system(board_size)
+
+    solvable = ~((lights.astype(np.int64) @ left_null.T.astype(np.int64)) & 1).any(axis=1)
+
+    particular = np.zeros(lights.shape, dtype=np.uint8)
+    particular[:, pivots] = (lights.astype(np.int64) @ transform.T.astype(np.int64)) & 1
+
+    # Minimum weight over the affine solution space particular + null space
+    packed = np.packbits(particular, axis=1, bitorder='little')
+    candidates = packed[:, np.newaxis, :] ^ null_space[np.newaxis, :, :]
+    weights = popcount(candidates).sum(axis=-1)
+    best = weights.argmin(axis=1)
+
+    solutions = np.unpackbits(candidates[np.arange(len(lights)), best], axis=1, count=num_lights, bitorder='little')
+    switch_counts = weights[np.arange(len(lights)), best]
+
+    solutions[~solvable] = 0
+    switch_counts[~solvable] = -1
+
+    return solutions, switch_counts, solvable
+
+
+def solve_lights_out(lights, board_size=None):
+    solutions, switch_counts, solvable = solve_lights_out_batch([lights], board_size)
+    if not solvable[0]:
+        return None, -1
+
+    return solutions[0].tolist(), int(switch_counts[0])
+
+
+def all_lights_out_solutions(lights, board_size=None):
+    num_lights = len(lights)
+    if board_size is None:
+        board_size = int(np.sqrt(num_lights))
+
+    pivots, transform, left_null, null_basis, _ = lights_out_system(board_size)
+
+    lights = np.asarray(lights, dtype=np.int64)
+    if ((left_null.astype(np.int64) @ lights) & 1).any():
+        return []
+
+    particular = 0
+    for p, bit in zip(pivots, (transform.astype(np.int64) @ lights) & 1):
+        particular |= int(bit) << p
+
+    solutions = [particular]
+    for vector in null_basis:
+        solutions += [s ^ vector for s in solutions]
+
+    return sorted(solutions)
+
+
+if __name__ == "__main__":
+    print(solve_lights_out([1, 0, 1, 1]))
+    print(solve_lights_out([0, 0, 0, 1, 0, 1, 1, 1, 0]))
+
+    lightsout4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+                  [1, 0, 1, 0, 0, 0, 1, 1, 0],
+                  [1, 0, 1, 1, 1, 1, 0, 0, 1],
+                  [1, 0, 0, 0, 0, 0, 1, 0, 0]
+                  ]
+
+    solutions, switch_counts, _ = solve_lights_out_batch(lightsout4)
+    for solution, count in zip(solutions, switch_counts):
+        print(f"Solution: {''.join(map(str, solution))}\tSwitches: {count}")
+
+    for board_size in [4, 5]:
+        boards = np.random.randint(2, size=(10000, board_size ** 2))
+        _, switch_counts, solvable = solve_lights_out_batch(boards)
+        print(f"{board_size}x{board_size}: {solvable.mean():.3f} solvable, switch counts {np.bincount(switch_counts[solvable])}")
@@ -0,0 +1,246 @@
+from collections import Counter
+
+from qiskit import QuantumCircuit
+from qiskit.circuit import ControlledGate, Gate, Instruction
+from qiskit.circuit.library import RCCXGate, RC3XGate
+
+from utils.cost_model import gate_cost
+
+
+# Peephole pass over the top level of a composed circuit. The blocks of a
+# pipeline are emitted independently, so their boundaries leave pairs of
+# mutually inverse gates (X brackets, H layers, compute/uncompute CXs) that
+# only cancel once the blocks are seen together.
+#
+# A gate commutes with a Pauli P on one of its qubits if it is block diagonal
+# in the eigenbasis of P there. Two gates commute if they agree on such a
+# Pauli for every qubit they share, so a gate is moved backwards past every
+# gate it commutes with until it meets its inverse on the same qubits or a
+# gate it does not commute with.
+#
+# Custom gates are inlined unless the same gate object is used more than once
+# in a circuit: those are the cached blocks (G^k of the Lights Out search),
+# inlining them would multiply the circuit size for a few boundary gates.
+#
+# A Toffoli (or 3-controlled X) whose mirror follows after a block that uses
+# its qubits only as controls is replaced by the relative phase version: the
+# relative phase is diagonal and the block in between keeps it diagonal, so
+# the phases of the pair cancel.
+
+_SELF_INVERSE = {'x', 'y', 'z', 'h', 'cx', 'cy', 'cz', 'ch', 'ccx', 'ccz', 'swap', 'cswap', 'rccx'}
+
+_INVERSES = {'s': 'sdg', 'sdg': 's', 't': 'tdg', 'tdg': 't', 'rccx_dg': 'rccx',
+             'rcccx': 'rcccx_dg', 'rcccx_dg': 'rcccx'}
+
+_DIAGONAL = {'z', 's', 'sdg', 't', 'tdg', 'rz', 'p', 'u1', 'cz', 'ccz', 'cp', 'cu1', 'crz', 'mcphase', 'mcu1'}
+
+# Controls are block diagonal in Z, the target is not
+_RELATIVE_PHASE = {'rccx', 'rccx_dg', 'rcccx', 'rcccx_dg'}
+
+
+def _is_mcx(inst):
+    return isinstance(inst, ControlledGate) and inst.base_gate.name == 'x'
+
+
+def _is_primitive(inst):
+    # Library gates and the named relative phase inverses stay as they are
+    return type(inst) not in (Gate, Instruction) or inst.name in _RELATIVE_PHASE or inst.definition is None
+
+
+def _roles(inst):
+    # Per qubit the Pauli the gate commutes with there, None if there is none
+    name, n = inst.name, inst.num_qubits
+    if name in _DIAGONAL:
+        return ('z',) * n
+    elif name == 'x':
+        return ('x',)
+    elif _is_mcx(inst) and n == inst.num_ctrl_qubits + 1:
+        return ('z',) * inst.num_ctrl_qubits + ('x',)
+    elif name in _RELATIVE_PHASE:
+        return ('z',) * (n - 1) + (None,)
+    return (None,) * n
+
+
+def _commute(a, a_qubits, b, b_qubits):
+    a_roles = dict(zip(a_qubits, _roles(a)))
+    for q, role in zip(b_qubits, _roles(b)):
+        if q in a_roles and (role is None or role != a_roles[q]):
+            return False
+    return True
+
+
+def _inverse_name(inst):
+    if inst.params or getattr(inst, 'condition', None) is not None:
+        return None
+    elif inst.name in _SELF_INVERSE or (_is_mcx(inst) and inst.definition is not None):
+        return inst.name
+    return _INVERSES.get(inst.name)
+
+
+def _qubit_key(inst, qubits):
+    # Controls of an all-ones controlled X are interchangeable
+    if _is_mcx(inst) and inst.ctrl_state == 2 ** inst.num_ctrl_qubits - 1 and len(qubits) == inst.num_ctrl_qubits + 1:
+        return frozenset(qubits[:-1]), qubits[-1:]
+    return tuple(qubits)
+
+
+def _cancels(a, a_qubits, b, b_qubits):
+    return (_inverse_name(a) == b.name and b.name is not None
+            and a.num_qubits == b.num_qubits
+            and getattr(a, 'ctrl_state', None) == getattr(b, 'ctrl_state', None)
+            and _qubit_key(a, a_qubits) == _qubit_key(b, b_qubits))
+
+
+def _inline(qc, inline_repeated=False):
+    # Top level instructions with custom gates replaced by their bodies and
+    # the global phase the bodies add
+    uses = Counter(id(inst) for inst, _, _ in qc.data)
+
+    data = []
+    phase = 0
+    for inst, qargs, cargs in qc.data:
+        if _is_primitive(inst) or (uses[id(inst)] > 1 and not inline_repeated):
+            data.append((inst, list(qargs), list(cargs)))
+            continue
+
+        definition = inst.definition
+        qubit_map = dict(zip(definition.qubits, qargs))
+        clbit_map = dict(zip(definition.clbits, cargs))
+        sub_data, sub_phase = _inline(definition, inline_repeated)
+        for sub_inst, sub_qargs, sub_cargs in sub_data:
+            data.append((sub_inst, [qubit_map[q] for q in sub_qargs], [clbit_map[c] for c in sub_cargs]))
+        phase += definition.global_phase + sub_phase
+
+    return data, phase
+
+
+def _record(report, rule, saved):
+    count, cost = report.get(rule, (0, 0))
+    report[rule] = (count + 1, cost + saved)
+
+
+def _cancel_pass(data, report, respect_barriers, max_window):
+    ops = []
+    # qubit -> indices into ops of the live instructions on it
+    on_qubit = {}
+
+    for inst, qargs, cargs in data:
+        partner = None
+        if _inverse_name(inst) is not None and not cargs:
+            candidates = sorted({i for q in qargs for i in on_qubit.get(q, [])}, reverse=True)
+            for i in candidates[:max_window]:
+                other, other_qargs, other_cargs = ops[i]
+                if other.name == 'barrier' and not respect_barriers:
+                    continue
+                if not other_cargs and _cancels(other, other_qargs, inst, qargs):
+                    partner = i
+                    break
+                if other_cargs or not _commute(other, other_qargs, inst, qargs):
+                    break
+
+        if partner is not None:
+            other, other_qargs, _ = ops[partner]
+            _record(report, f"cancel {inst.name}", gate_cost(other) + gate_cost(inst))
+            ops[partner] = None
+            for q in other_qargs:
+                on_qubit[q].remove(partner)
+            continue
+
+        for q in qargs:
+            on_qubit.setdefault(q, []).append(len(ops))
+        ops.append((inst, qargs, cargs))
+
+    return [op for op in ops if op is not None]
+
+
+def _relative_phase_pass(data, report, respect_barriers):
+    data = list(data)
+    replaced = set()
+
+    for i, (inst, qargs, cargs) in enumerate(data):
+        if i in replaced or not _is_mcx(inst) or inst.num_ctrl_qubits not in (2, 3) \
+                or inst.num_qubits != inst.num_ctrl_qubits + 1 or inst.ctrl_state != 2 ** inst.num_ctrl_qubits - 1:
+            continue
+
+        for j in range(i + 1, len(data)):
+            other, other_qargs, other_cargs = data[j]
+            shared = set(qargs) & set(other_qargs)
+            if not shared:
+                continue
+            if other.name == 'barrier' and not respect_barriers:
+                continue
+            if j not in replaced and other.name == inst.name and other.ctrl_state == inst.ctrl_state \
+                    and list(other_qargs) == list(qargs):
+                if inst.num_ctrl_qubits == 2:
+                    first, second = RCCXGate(), RCCXGate()
+                else:
+                    first, second = RC3XGate(), RC3XGate().inverse()
+                _record(report, f"relative phase {inst.name}",
+                        gate_cost(inst) + gate_cost(other) - gate_cost(first) - gate_cost(second))
+                data[i] = (first, qargs, cargs)
+                data[j] = (second, other_qargs, other_cargs)
+                replaced |= {i, j}
+                break
+            # The block in between may only use the qubits as controls
+            roles = dict(zip(other_qargs, _roles(other)))
+            if other_cargs or any(roles[q] != 'z' for q in shared):
+                break
+
+    return data
+
+
+def optimize_circuit(qc, inline=True, relative_phase=True, respect_barriers=False, max_window=256,
+                     inline_repeated=False):
+    # Returns the optimized copy of qc and the report rule -> (count, cost
+    # saved). Barriers are kept but gates cancel across them unless
+    # respect_barriers is set.
+    report = {}
+    if inline:
+        data, phase = _inline(qc, inline_repeated)
+    else:
+        data, phase = [(inst, list(qargs), list(cargs)) for inst, qargs, cargs in qc.data], 0
+
+    while True:
+        size = len(data)
+        data = _cancel_pass(data, report, respect_barriers, max_window)
+        if len(data) == size:
+            break
+
+    if relative_phase:
+        data = _relative_phase_pass(data, report, respect_barriers)
+
+    optimized = QuantumCircuit(*qc.qregs, *qc.cregs, name=qc.name)
+    optimized.global_phase = qc.global_phase + phase
+    for inst, qargs, cargs in data:
+        optimized.append(inst, qargs, cargs)
+
+    return optimized, report
+
+
+def format_peephole_report(report):
+    lines = [f"{'rule':<32}{'count':>8}{'saved':>10}"]
+    for rule, (count, saved) in sorted(report.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{rule:<32}{count:>8}{saved:>10}")
+    lines.append(f"{'total':<32}{sum(c for c, _ in report.values()):>8}{sum(s for _, s in report.values()):>10}")
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from week2b import week2b_ans_func
+    from week3 import week3_ans_func
+    from utils.board_tools import board2_bitstrings
+    from utils.cost_model import compute_cost
+    from datasets.data import problem_set
+
+    lightsout4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+                  [1, 0, 1, 0, 0, 0, 1, 1, 0],
+                  [1, 0, 1, 1, 1, 1, 0, 0, 1],
+                  [1, 0, 0, 0, 0, 0, 1, 0, 0]
+                  ]
+
+    for name, qc in [("week2b", week2b_ans_func(lightsout4, optimize=False)),
+                     ("week3", week3_ans_func(board2_bitstrings(problem_set), optimize=False))]:
+        optimized, report = optimize_circuit(qc)
+        print(f"{name}: {compute_cost(qc)} -> {compute_cost(optimized)}")
+        print(format_peephole_report(report))
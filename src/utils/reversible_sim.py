@@ -0,0 +1,195 @@
+import numpy as np
+
+from qiskit import QuantumCircuit, QuantumRegister
+from qiskit.circuit import ControlledGate, Gate, Instruction
+
+
+# Bit-parallel simulation of classical reversible circuits. Every qubit holds a
+# packed bit vector with one bit per basis input (lane), so an X/CX/Toffoli
+# layer is a handful of NumPy bitwise operations over all inputs at once.
+
+# Gates without effect on basis states
+_IGNORED = {'barrier', 'measure', 'id', 'delay', 'snapshot'}
+
+# Diagonal gates, they only change phases of basis states
+_PHASE_GATES = {'z', 's', 'sdg', 't', 'tdg', 'rz', 'u1', 'p', 'cz', 'cu1', 'cp', 'crz', 'ccz', 'mcu1', 'mcphase',
+                'global_phase'}
+
+# Toffolis up to a relative phase
+_RELATIVE_PHASE_GATES = {'rccx', 'rcccx', 'rcccx_dg'}
+
+
+def qubit_indices(circuit, qubits):
+    if isinstance(qubits, QuantumRegister):
+        qubits = qubits[:]
+
+    index = {q: i for i, q in enumerate(circuit.qubits)}
+    return [q if isinstance(q, (int, np.integer)) else index[q] for q in qubits]
+
+
+def find_nonclassical_gates(circuit):
+    if isinstance(circuit, Instruction):
+        circuit = circuit.definition
+
+    found = set()
+    for inst, _, _ in circuit.data:
+        name = inst.name
+        if name in _IGNORED or name in _PHASE_GATES or name in _RELATIVE_PHASE_GATES or name in ('x', 'swap', 'cswap'):
+            continue
+        elif isinstance(inst, ControlledGate) and inst.base_gate.name == 'x':
+            continue
+        elif type(inst) in (Gate, Instruction) and inst.definition is not None:
+            found |= find_nonclassical_gates(inst.definition)
+        else:
+            found.add(name)
+
+    return found
+
+
+def pack_inputs(inputs, num_qubits):
+    if num_qubits > 64:
+        raise ValueError(f"Basis states of {num_qubits} qubits do not fit into 64 bit integers")
+
+    inputs = np.asarray(inputs, dtype=np.uint64)
+    shifts = np.arange(num_qubits, dtype=np.uint64)
+    bits = ((inputs[np.newaxis, :] >> shifts[:, np.newaxis]) & np.uint64(1)).astype(np.uint8)
+
+    packed = np.packbits(bits, axis=1, bitorder='little')
+    padding = -packed.shape[1] % 8
+    packed = np.pad(packed, ((0, 0), (0, padding)))
+
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def unpack_outputs(state, num_lanes):
+    bits = np.unpackbits(state.view(np.uint8), axis=1, count=num_lanes, bitorder='little')
+    shifts = np.arange(state.shape[0], dtype=np.uint64)
+
+    return np.bitwise_or.reduce(bits.astype(np.uint64) << shifts[:, np.newaxis], axis=0)
+
+
+def _toggle(state, controls, ctrl_state, target, lane_mask):
+    condition = lane_mask.copy()
+    for n, c in enumerate(controls):
+        if ctrl_state >> n & 1:
+            condition &= state[c]
+        else:
+            condition &= ~state[c]
+    state[target] ^= condition
+
+
+def _run(data, qubit_map, state, lane_mask, report):
+    for inst, qargs, _ in data:
+        name = inst.name
+        q = [qubit_map[x] for x in qargs]
+
+        if name in _IGNORED:
+            continue
+        elif name in _PHASE_GATES:
+            report['phase_gates'].add(name)
+        elif name == 'x':
+            state[q[0]] ^= lane_mask
+        elif name == 'swap':
+            state[[q[0], q[1]]] = state[[q[1], q[0]]]
+        elif name == 'cswap':
+            diff = (state[q[1]] ^ state[q[2]]) & state[q[0]]
+            state[q[1]] ^= diff
+            state[q[2]] ^= diff
+        elif name in _RELATIVE_PHASE_GATES:
+            report['phase_gates'].add(name)
+            _toggle(state, q[:-1], (1 << (len(q) - 1)) - 1, q[-1], lane_mask)
+        elif isinstance(inst, ControlledGate) and inst.base_gate.name == 'x':
+            k = inst.num_ctrl_qubits
+            ancillas = q[k + 1:]
+            # The clean ancilla v-chain only acts as an MCX if its ancillas
+            # start in |0>, otherwise follow its decomposition
+            if name == 'mcx_vchain' and not inst._dirty_ancillas and state[ancillas].any():
+                sub_map = {x: q[i] for i, x in enumerate(inst.definition.qubits)}
+                _run(inst.definition.data, sub_map, state, lane_mask, report)
+            else:
+                _toggle(state, q[:k], inst.ctrl_state, q[k], lane_mask)
+        elif type(inst) in (Gate, Instruction) and inst.definition is not None:
+            sub_map = {x: q[i] for i, x in enumerate(inst.definition.qubits)}
+            _run(inst.definition.data, sub_map, state, lane_mask, report)
+        else:
+            report['nonclassical'].add(name)
+
+
+def simulate_reversible(circuit, inputs):
+    if isinstance(circuit, Instruction):
+        circuit = circuit.definition
+
+    nonclassical = find_nonclassical_gates(circuit)
+    if nonclassical:
+        raise ValueError(f"Circuit contains non-classical gates: {sorted(nonclassical)}")
+
+    inputs = np.atleast_1d(np.asarray(inputs, dtype=np.uint64))
+    state = pack_inputs(inputs, circuit.num_qubits)
+
+    lane_mask = pack_inputs(np.ones(len(inputs), dtype=np.uint64), 1)[0]
+
+    report = {'phase_gates': set(), 'nonclassical': set()}
+    qubit_map = {q: i for i, q in enumerate(circuit.qubits)}
+    _run(circuit.data, qubit_map, state, lane_mask, report)
+
+    return unpack_outputs(state, len(inputs)), report
+
+
+def basis_inputs(circuit, input_qubits, fixed=0):
+    # All assignments of the input qubits, input m sets input_qubits[j] to bit j
+    # of m. The remaining qubits are taken from fixed.
+    input_qubits = qubit_indices(circuit, input_qubits)
+    m = np.arange(2 ** len(input_qubits), dtype=np.uint64)
+
+    inputs = np.full(len(m), fixed, dtype=np.uint64)
+    for j, q in enumerate(input_qubits):
+        inputs |= ((m >> np.uint64(j)) & np.uint64(1)) << np.uint64(q)
+
+    return inputs
+
+
+def extract_bits(states, circuit, qubits):
+    qubits = qubit_indices(circuit, qubits)
+    values = np.zeros(len(states), dtype=np.uint64)
+    for j, q in enumerate(qubits):
+        values |= ((states >> np.uint64(q)) & np.uint64(1)) << np.uint64(j)
+
+    return values
+
+
+def truth_table(circuit, input_qubits, output_qubits, fixed=0):
+    if isinstance(circuit, Instruction):
+        circuit = circuit.definition
+
+    outputs, report = simulate_reversible(circuit, basis_inputs(circuit, input_qubits, fixed))
+    return extract_bits(outputs, circuit, output_qubits), report
+
+
+if __name__ == "__main__":
+    from circuit_parts.adder import counter_4bit_gate, counter_9bit_gate
+    from board_qram import write_qram
+
+    # Counters: sum bits of every input against its Hamming weight
+    counts, _ = truth_table(counter_4bit_gate(), range(4), range(4, 7))
+    weights = [bin(m).count('1') for m in range(2 ** 4)]
+    print(f"4 bit counter correct: {np.array_equal(counts, weights)}")
+
+    counts, _ = truth_table(counter_9bit_gate(), range(9), range(12, 16))
+    weights = [bin(m).count('1') for m in range(2 ** 9)]
+    print(f"9 bit counter correct: {np.array_equal(counts, weights)}")
+
+    # Board QRAM: data register content for every address
+    lightsout4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+                  [1, 0, 1, 0, 0, 0, 1, 1, 0],
+                  [1, 0, 1, 1, 1, 1, 0, 0, 1],
+                  [1, 0, 0, 0, 0, 0, 1, 0, 0]
+                  ]
+
+    address = QuantumRegister(2, name='address')
+    data = QuantumRegister(9, name='data')
+    qc = QuantumCircuit(address, data)
+    write_qram(lightsout4, qc, address, data)
+
+    contents, _ = truth_table(qc, address[::-1], data)
+    for n, content in enumerate(contents):
+        print(f"Memory Cell: {n:02b}\tContent: {''.join(str(int(content) >> j & 1) for j in range(9))}")
@@ -0,0 +1,315 @@
+import numpy as np
+
+from qiskit import QuantumCircuit
+from qiskit.circuit import ControlledGate, Gate, Instruction
+
+
+# Statevector simulation that only stores the non-zero basis states as two
+# arrays: basis state integers (qubit i in bit i) and their amplitudes.
+# Permutation-like gates (X, CX, Toffoli, MCX, SWAP, relative phase Toffolis,
+# diagonal gates) just relabel and rephase the stored states. Gates that create
+# superpositions branch every stored state and merge equal basis states again.
+# Once the support covers a large part of the Hilbert space the simulation
+# continues on a dense vector.
+
+_IGNORED = {'barrier', 'id', 'delay', 'snapshot'}
+
+_ZERO = 1e-12
+
+
+def _qubit_map(definition, qubits):
+    return {x: qubits[i] for i, x in enumerate(definition.qubits)}
+
+
+def _scatter(local, qubits):
+    # Spread the bits of local index l onto the given qubits
+    values = np.zeros(len(local), dtype=np.uint64)
+    for j, q in enumerate(qubits):
+        values |= ((local >> np.uint64(j)) & np.uint64(1)) << np.uint64(q)
+    return values
+
+
+def _gather(keys, qubits):
+    local = np.zeros(len(keys), dtype=np.uint64)
+    for j, q in enumerate(qubits):
+        local |= ((keys >> np.uint64(q)) & np.uint64(1)) << np.uint64(j)
+    return local
+
+
+_matrix_cache = {}
+
+
+def _gate_matrix(inst):
+    # Matrix of a library gate acting on a few qubits, and whether it is
+    # monomial (a permutation with phases), in which case it is returned as
+    # the permutation and the phases
+    if type(inst) in (Gate, Instruction) or inst.num_qubits > 5:
+        return None
+
+    try:
+        key = (type(inst), inst.name, tuple(float(p) for p in inst.params))
+    except (TypeError, ValueError):
+        key = None
+
+    if key is not None and key in _matrix_cache:
+        return _matrix_cache[key]
+
+    try:
+        matrix = np.asarray(inst.to_matrix(), dtype=complex)
+    except Exception:
+        matrix = None
+
+    entry = None
+    if matrix is not None:
+        nonzero = np.abs(matrix) > _ZERO
+        if (nonzero.sum(axis=0) == 1).all():
+            permutation = nonzero.argmax(axis=0).astype(np.uint64)
+            phases = matrix[permutation.astype(np.int64), np.arange(len(matrix))]
+            entry = ('monomial', permutation, phases)
+        else:
+            entry = ('matrix', matrix, None)
+
+    if key is not None:
+        _matrix_cache[key] = entry
+    return entry
+
+
+class SparseState:
+
+    def __init__(self, num_qubits, max_dense_qubits=24, dense_fraction=0.25):
+        if num_qubits > 64:
+            raise ValueError(f"Basis states of {num_qubits} qubits do not fit into 64 bit integers")
+
+        self.num_qubits = num_qubits
+        self.max_dense_qubits = max_dense_qubits
+        self.dense_fraction = dense_fraction
+
+        self.keys = np.zeros(1, dtype=np.uint64)
+        self.amps = np.ones(1, dtype=complex)
+        self.dense = None
+
+    @property
+    def support(self):
+        if self.dense is not None:
+            return int((np.abs(self.dense) > _ZERO).sum())
+        return len(self.keys)
+
+    def _indices(self):
+        return np.arange(2 ** self.num_qubits, dtype=np.uint64)
+
+    def _maybe_densify(self):
+        if self.dense is None and self.num_qubits <= self.max_dense_qubits \
+                and len(self.keys) > self.dense_fraction * 2 ** self.num_qubits:
+            self.dense = np.zeros(2 ** self.num_qubits, dtype=complex)
+            self.dense[self.keys.astype(np.int64)] = self.amps
+            self.keys = self.amps = None
+
+    def any_set(self, mask):
+        if self.dense is not None:
+            populated = np.abs(self.dense) > _ZERO
+            return bool((populated & ((self._indices() & np.uint64(mask)) != 0)).any())
+        return bool((self.keys & np.uint64(mask)).any())
+
+    def global_phase(self, phase):
+        if phase:
+            if self.dense is not None:
+                self.dense *= np.exp(1j * phase)
+            else:
+                self.amps *= np.exp(1j * phase)
+
+    def permute(self, mapping, phases=None):
+        # mapping is a bijection on basis states, phases multiply the amplitude
+        # of each state before it is moved
+        if self.dense is not None:
+            indices = self._indices()
+            new = np.empty_like(self.dense)
+            values = self.dense if phases is None else self.dense * phases(indices)
+            new[mapping(indices).astype(np.int64)] = values
+            self.dense = new
+        else:
+            if phases is not None:
+                self.amps = self.amps * phases(self.keys)
+            self.keys = mapping(self.keys)
+
+    def apply_matrix(self, matrix, qubits):
+        k = len(qubits)
+
+        if self.dense is not None:
+            n = self.num_qubits
+            tensor = self.dense.reshape([2] * n)
+            gate = matrix.reshape([2] * (2 * k))
+            # Qubit q is axis n - 1 - q of the C-ordered tensor, local bit j is
+            # axis k - 1 - j of the gate
+            state_axes = [n - 1 - qubits[j] for j in reversed(range(k))]
+            result = np.tensordot(gate, tensor, axes=(list(range(k, 2 * k)), state_axes))
+            self.dense = np.moveaxis(result, list(range(k)), state_axes).reshape(-1)
+            return
+
+        mask = np.uint64(0)
+        for q in qubits:
+            mask |= np.uint64(1) << np.uint64(q)
+
+        local = _gather(self.keys, qubits).astype(np.int64)
+        base = self.keys & ~mask
+        spread = _scatter(np.arange(2 ** k, dtype=np.uint64), qubits)
+
+        keys = (base[:, np.newaxis] | spread[np.newaxis, :]).reshape(-1)
+        amps = (matrix[:, local].T * self.amps[:, np.newaxis]).reshape(-1)
+
+        keep = np.abs(amps) > _ZERO
+        keys, amps = keys[keep], amps[keep]
+
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        self.amps = np.bincount(inverse, amps.real, len(self.keys)) + 1j * np.bincount(inverse, amps.imag, len(self.keys))
+
+        keep = np.abs(self.amps) > _ZERO
+        self.keys, self.amps = self.keys[keep], self.amps[keep]
+
+        self._maybe_densify()
+
+    def probabilities(self):
+        if self.dense is not None:
+            probs = np.abs(self.dense) ** 2
+            populated = probs > _ZERO ** 2
+            return self._indices()[populated], probs[populated]
+        return self.keys, np.abs(self.amps) ** 2
+
+
+def _controlled_x(controls, ctrl_state, target):
+    cond_mask = np.uint64(0)
+    cond_value = np.uint64(0)
+    for n, c in enumerate(controls):
+        cond_mask |= np.uint64(1) << np.uint64(c)
+        if ctrl_state >> n & 1:
+            cond_value |= np.uint64(1) << np.uint64(c)
+
+    def mapping(keys):
+        fire = ((keys & cond_mask) == cond_value).astype(np.uint64)
+        return keys ^ (fire << np.uint64(target))
+
+    return mapping
+
+
+def _monomial(permutation, phases, qubits):
+    mask = np.uint64(0)
+    for q in qubits:
+        mask |= np.uint64(1) << np.uint64(q)
+
+    def mapping(keys):
+        local = _gather(keys, qubits).astype(np.int64)
+        return (keys & ~mask) | _scatter(permutation[local], qubits)
+
+    def phase(keys):
+        return phases[_gather(keys, qubits).astype(np.int64)]
+
+    return mapping, (None if np.allclose(phases, 1) else phase)
+
+
+def _run(state, data, qubit_map, measured):
+    for inst, qargs, cargs in data:
+        name = inst.name
+        q = [qubit_map[x] for x in qargs]
+
+        if name in _IGNORED:
+            continue
+        elif name == 'measure':
+            measured[q[0]] = cargs[0]
+            continue
+
+        if measured and any(qubit in measured for qubit in q):
+            raise ValueError(f"Gate {name} acts on a measured qubit, only final measurements are supported")
+
+        if isinstance(inst, ControlledGate) and inst.base_gate.name == 'x':
+            k = inst.num_ctrl_qubits
+            ancilla_mask = sum(1 << a for a in q[k + 1:])
+            # The clean ancilla v-chain only acts as an MCX if its ancillas
+            # are in |0>
+            if name == 'mcx_vchain' and not inst._dirty_ancillas and state.any_set(ancilla_mask):
+                state.global_phase(float(getattr(inst.definition, 'global_phase', 0)))
+                _run(state, inst.definition.data, _qubit_map(inst.definition, q), measured)
+            else:
+                state.permute(_controlled_x(q[:k], inst.ctrl_state, q[k]))
+            continue
+
+        entry = _gate_matrix(inst)
+        if entry is not None and entry[0] == 'monomial':
+            mapping, phase = _monomial(entry[1], entry[2], q)
+            state.permute(mapping, phase)
+        elif entry is not None:
+            state.apply_matrix(entry[1], q)
+        elif inst.definition is not None:
+            state.global_phase(float(getattr(inst.definition, 'global_phase', 0)))
+            _run(state, inst.definition.data, _qubit_map(inst.definition, q), measured)
+        else:
+            raise ValueError(f"Gate {name} has neither a matrix nor a definition")
+
+
+def sparse_statevector(circuit, max_dense_qubits=24):
+    state = SparseState(circuit.num_qubits, max_dense_qubits=max_dense_qubits)
+    measured = {}
+
+    qubit_map = {q: i for i, q in enumerate(circuit.qubits)}
+    state.global_phase(float(getattr(circuit, 'global_phase', 0)))
+    _run(state, circuit.data, qubit_map, measured)
+
+    clbit_index = {c: i for i, c in enumerate(circuit.clbits)}
+    return state, [(q, clbit_index[c]) for q, c in measured.items()]
+
+
+def _format_counts(circuit, values, counts):
+    # Same layout as Result.get_counts(): highest clbit first, registers
+    # separated by spaces with the last register first
+    result = {}
+    for value, count in zip(values, counts):
+        bits = format(int(value), f"0{circuit.num_clbits}b")[::-1]
+        words = []
+        offset = 0
+        for creg in circuit.cregs:
+            words.append(bits[offset:offset + creg.size][::-1])
+            offset += creg.size
+        result[' '.join(reversed(words))] = int(count)
+
+    return result
+
+
+def run_sparse(circuit, shots=1000, seed_simulator=None, max_dense_qubits=24):
+    state, measured = sparse_statevector(circuit, max_dense_qubits)
+    keys, probs = state.probabilities()
+
+    values = np.zeros(len(keys), dtype=np.uint64)
+    for qubit, clbit in measured:
+        values &= ~(np.uint64(1) << np.uint64(clbit))
+        values |= ((keys >> np.uint64(qubit)) & np.uint64(1)) << np.uint64(clbit)
+
+    outcomes, inverse = np.unique(values, return_inverse=True)
+    outcome_probs = np.bincount(inverse.reshape(-1), probs, len(outcomes))
+    outcome_probs /= outcome_probs.sum()
+
+    rng = np.random.default_rng(seed_simulator)
+    samples = rng.multinomial(shots, outcome_probs)
+    sampled = samples > 0
+
+    return _format_counts(circuit, outcomes[sampled], samples[sampled])
+
+
+if __name__ == "__main__":
+    import time
+
+    from week2b import week2b_ans_func
+    from week3 import week3_ans_func
+    from utils.board_tools import board2_bitstrings
+    from datasets.data import problem_set
+
+    lightsout4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+                  [1, 0, 1, 0, 0, 0, 1, 1, 0],
+                  [1, 0, 1, 1, 1, 1, 0, 0, 1],
+                  [1, 0, 0, 0, 0, 0, 1, 0, 0]
+                  ]
+
+    for name, qc in [("week2b", week2b_ans_func(lightsout4)), ("week3", week3_ans_func(board2_bitstrings(problem_set)))]:
+        start = time.time()
+        count = run_sparse(qc, shots=1000)
+        print(f"{name}: {time.time() - start:.2f}s")
+        for k in sorted(count, key=count.get, reverse=True)[:5]:
+            print(f"Solution: {k}\tCounts: {count[k]}")
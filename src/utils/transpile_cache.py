@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import qiskit
+
+from qiskit import transpile
+
+from utils.circuit_serializer import dumps, load_file
+
+
+# Transpiled circuits on local disk. The key is a structural hash of the
+# circuit (gate_key of every instruction and the bit indices it acts on), the
+# backend configuration, the optimization level, the transpiler seed and the
+# qiskit versions. Entries are stored with utils.circuit_serializer, one file
+# per key, and memory mapped on load. Loading parses the file and never runs
+# code from it, but a writer of the directory still decides which circuits
+# get simulated, so it is created private to the user and should not be
+# shared with untrusted users. Circuits the serializer does not support are
+# transpiled every time. A hit touches the file, so the modification times
+# order the entries by last use and the oldest ones are evicted once the
+# directory outgrows max_bytes. Writes go through a temporary file and a
+# rename, worker processes can share one directory (the hit and miss counters
+# are per process).
+
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+
+_SUFFIX = '.qcb'
+
+
+def _versions():
+    try:
+        import qiskit_aer
+
+        return qiskit.__version__, qiskit_aer.__version__
+    except ImportError:
+        return qiskit.__version__, None
+
+
+def circuit_key(qc):
+    from utils.cost_model import gate_key
+
+    memo = {}
+    qubit_index = {q: i for i, q in enumerate(qc.qubits)}
+    clbit_index = {c: i for i, c in enumerate(qc.clbits)}
+
+    parts = [str(qc.num_qubits), str(qc.num_clbits), repr(qc.global_phase)]
+    for register in qc.qregs:
+        parts.append(f"q {register.name} " + ','.join(str(qubit_index[q]) for q in register))
+    for register in qc.cregs:
+        parts.append(f"c {register.name} " + ','.join(str(clbit_index[c]) for c in register))
+
+    for inst, qargs, cargs in qc.data:
+        parts.append(gate_key(inst, memo))
+        parts.append(','.join(str(qubit_index[q]) for q in qargs))
+        parts.append(','.join(str(clbit_index[c]) for c in cargs))
+        condition = getattr(inst, 'condition', None)
+        if condition is not None:
+            target, value = condition
+            bits = [target] if target in clbit_index else list(target)
+            parts.append(f"if {','.join(str(clbit_index[c]) for c in bits)}=={value}")
+
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+
+def backend_key(backend):
+    configuration = json.dumps(backend.configuration().to_dict(), sort_keys=True, default=str)
+    return hashlib.sha256(configuration.encode()).hexdigest()
+
+
+class TranspileCache:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def key(self, circuit, backend, optimization_level=1, seed_transpiler=None):
+        parts = [circuit_key(circuit), backend_key(backend), str(optimization_level), repr(seed_transpiler),
+                 *map(str, _versions())]
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + _SUFFIX)
+
+    def _entries(self):
+        # (modification time, size, file) of every entry
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith(_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.path, name)))
+        return entries
+
+    def get(self, key):
+        file = self._file(key)
+        try:
+            circuit = load_file(file)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated or written by an incompatible version
+            self._remove(file)
+            return None
+
+        try:
+            os.utime(file)
+        except FileNotFoundError:
+            pass
+        return circuit
+
+    def put(self, key, circuit):
+        try:
+            data = dumps(circuit)
+        except ValueError:
+            return
+        if len(data) > self.max_bytes:
+            return
+
+        fd, temporary = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, self._file(key))
+
+        self.evict()
+
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(file)
+            total -= size
+
+    def _remove(self, file):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        for _, _, file in self._entries():
+            self._remove(file)
+
+    def stats(self):
+        entries = self._entries()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries), 'max_bytes': self.max_bytes}
+
+
+_transpile_cache = None
+
+
+def enable_transpile_cache(path, max_bytes=DEFAULT_MAX_BYTES):
+    global _transpile_cache
+    _transpile_cache = TranspileCache(path, max_bytes)
+    return _transpile_cache
+
+
+def disable_transpile_cache():
+    global _transpile_cache
+    _transpile_cache = None
+
+
+def get_transpile_cache():
+    return _transpile_cache
+
+
+def transpile_circuits(circuits, backend, optimization_level=1, seed_transpiler=None, cache=None):
+    # transpile() through the cache, cache None uses the one enabled with
+    # enable_transpile_cache and transpiles directly if there is none. The
+    # misses are transpiled as one batch.
+    if cache is None:
+        cache = _transpile_cache
+    if cache is None:
+        return list(transpile(circuits, backend, optimization_level=optimization_level,
+                              seed_transpiler=seed_transpiler))
+
+    keys = [cache.key(qc, backend, optimization_level, seed_transpiler) for qc in circuits]
+    transpiled = [cache.get(key) for key in keys]
+
+    missing = [n for n, qc in enumerate(transpiled) if qc is None]
+    cache.hits += len(circuits) - len(missing)
+    cache.misses += len(missing)
+
+    if missing:
+        # Equal circuits in one call are transpiled once
+        unique = list(dict.fromkeys(keys[n] for n in missing))
+        first = {key: circuits[keys.index(key)] for key in unique}
+        compiled = transpile([first[key] for key in unique], backend, optimization_level=optimization_level,
+                             seed_transpiler=seed_transpiler)
+        for key, qc in zip(unique, compiled):
+            cache.put(key, qc)
+        compiled = dict(zip(unique, compiled))
+        for n in missing:
+            transpiled[n] = compiled[keys[n]]
+
+    return transpiled
+
+
+if __name__ == "__main__":
+    import time
+
+    from qiskit import Aer
+
+    from week2b import week2b_ans_func
+    from week3 import week3_ans_func
+    from utils.board_tools import board2_bitstrings
+    from datasets.data import problem_set
+
+    lightsout4 = [[1, 1, 1, 0, 0, 0, 1, 0, 0],
+                  [1, 0, 1, 0, 0, 0, 1, 1, 0],
+                  [1, 0, 1, 1, 1, 1, 0, 0, 1],
+                  [1, 0, 0, 0, 0, 0, 1, 0, 0]
+                  ]
+
+    backend = Aer.get_backend('qasm_simulator')
+    cache = TranspileCache(os.path.join(tempfile.mkdtemp(), 'transpile'))
+
+    for name, qc in [("week2b", week2b_ans_func(lightsout4, num_iterations=17)),
+                     ("week3", week3_ans_func(board2_bitstrings(problem_set)))]:
+        start = time.perf_counter()
+        transpile(qc, backend, optimization_level=1)
+        plain = time.perf_counter() - start
+
+        times = []
+        for _ in range(2):
+            start = time.perf_counter()
+            transpile_circuits([qc], backend, cache=cache)
+            times.append(time.perf_counter() - start)
+        print(f"{name}: transpile {plain:.3f}s\tcold cache {times[0]:.3f}s\twarm cache {times[1]:.3f}s")
+
+    print(cache.stats())
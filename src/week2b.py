@@ -1,14 +1,16 @@
 from qiskit import *
 from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit
-from qiskit import IBMQ, Aer, execute
+from qiskit import IBMQ
 
 import numpy as np
 import matplotlib.pyplot as plt
 
 from board_qram import write_qram, qRAM
-from board_oracles import lights_out_oracle, lights_out_oracle_gate
+from board_oracles import lights_out_oracle, lights_out_oracle_gate, lights_out_grover
 from circuit_parts.diffusers import diffuser, diffuser_gate
 from circuit_parts.adder import counter_4bit_gate, counter_9bit_gate
+from utils.execution import run_circuits, print_counts
+from lights_out_pipeline import lights_out_pipeline
 
 
 def simplified(lights, num_iterations=3):
@@ -34,16 +36,12 @@ def simplified(lights, num_iterations=3):
 
     write_qram(lights, qc, address_qubits, light_qubits)
     qc.barrier()
-    for i in range(num_iterations):
-        lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits)
-        diffuser(qc, switch_qubits, ancilla_qubits)
+    lights_out_grover(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits, num_iterations)
     qc.barrier()
 
     qc.ccx(switch_qubits[2], switch_qubits[3], output_qubit)
 
-    for i in range(num_iterations):
-        lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits)
-        diffuser(qc, switch_qubits, ancilla_qubits)
+    lights_out_grover(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits, num_iterations)
     qc.barrier()
 
     write_qram(lights, qc, address_qubits, light_qubits)
@@ -79,9 +77,7 @@ def downsized_problem(lights, num_iterations=3):
     write_qram(lights, qc, address_qubits, light_qubits)
     qc.barrier()
 
-    for i in range(num_iterations):
-        lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits)
-        diffuser(qc, switch_qubits, ancilla_qubits)
+    lights_out_grover(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits, num_iterations)
     qc.barrier()
 
     # Simple oracle: selects solution [1,1,0,1] belonging to board [0,1,0,0] at location 11
@@ -104,9 +100,7 @@ def downsized_problem(lights, num_iterations=3):
 
     qc.append(counter_4bit_gate().inverse(), switch_qubits[:] + ancilla_qubits[:])
 
-    for i in range(num_iterations):
-        lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits)
-        diffuser(qc, switch_qubits, ancilla_qubits)
+    lights_out_grover(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits, num_iterations)
     qc.barrier()
 
     write_qram(lights, qc, address_qubits, light_qubits)
@@ -120,75 +114,24 @@ def downsized_problem(lights, num_iterations=3):
     return qc
 
 
-def week2b_ans_func(lights, num_iterations=17):
-    switch_qubits = QuantumRegister(9, name='switch')
-    light_qubits = QuantumRegister(9, name='light')
-    address_qubits = QuantumRegister(2, name='address')
-    ancilla_qubits = QuantumRegister(7, name='ancilla')
-    output_qubit = QuantumRegister(1, name='out')
-    cbits = ClassicalRegister(2, name="cbits")
-    qc = QuantumCircuit(switch_qubits, light_qubits, address_qubits, ancilla_qubits, output_qubit, cbits)
-
-    # Initialization
-    # Flag to |->
-    qc.x(output_qubit)
-    qc.h(output_qubit)
-
-    # Address to |++>
-    qc.h(address_qubits)
-
-    # Switch to |+++++++++>
-    qc.h(switch_qubits)
-    qc.barrier()
-
-    write_qram(lights, qc, address_qubits, light_qubits)
-    qc.barrier()
-
-    for i in range(num_iterations):
-        lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits)
-        diffuser(qc, switch_qubits, ancilla_qubits)
-    qc.barrier()
+def week2b_ans_func(lights, num_iterations=17, allocator=None, optimize=True):
+    # The submitted circuit keeps 17 inner iterations (success 0.989, cost
+    # 62174). num_iterations=None asks the planner, which picks 16 for the
+    # four challenge boards (success 0.953, cost 58630): the cheaper circuit
+    # needs fewer runs per success, but a single run succeeds less often.
+    return lights_out_pipeline(lights, max_switches=3, num_iterations=num_iterations, allocator=allocator,
+                               optimize=optimize)
 
-    # Counter
-    qc.append(counter_9bit_gate(), switch_qubits[:] + ancilla_qubits[:])
-
-    # Select Solutions with only one switch, 2 MSB set to 0
-    qc.x(ancilla_qubits[5:])
-    qc.ccx(ancilla_qubits[5], ancilla_qubits[6], output_qubit)
-    qc.x(ancilla_qubits[5:])
 
-    qc.append(counter_9bit_gate().inverse(), switch_qubits[:] + ancilla_qubits[:])
-
-    for i in range(num_iterations):
-        lights_out_oracle(qc, switch_qubits, light_qubits, output_qubit, ancilla_qubits)
-        diffuser(qc, switch_qubits, ancilla_qubits)
-    qc.barrier()
-
-    write_qram(lights, qc, address_qubits, light_qubits)
-    diffuser(qc, address_qubits)
-
-    qc.barrier()
-    qc.measure(address_qubits, cbits)
-
-    qc = qc.reverse_bits()
-
-    return qc
-
-
-def run_circuit(lights, qc_generator, draw=False):
+def run_circuit(lights, qc_generator, draw=False, sparse=False):
     qc = qc_generator(lights)
 
     if draw:
         qc.draw(output='mpl')
         plt.show()
 
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend, shots=1000)
-    result = job.result()
-    count = result.get_counts()
-
-    for k in sorted(count, key=count.get, reverse=True):
-        print(f"Solution: {k}\tCounts: {count[k]}")
+    counts = run_circuits([qc], method='sparse' if sparse else 'aer')[0]
+    print_counts(counts)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,17 @@
 from qiskit import *
 from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit
-from qiskit import IBMQ, Aer, execute
+from qiskit import IBMQ
 
 import numpy as np
 import matplotlib.pyplot as plt
 
-from board_qram import write_qram, qRAM
-from asteroid_oracles import beam_checker
+from board_qram import write_qram, write_qram_num_ancillas, qRAM
+from asteroid_oracles import beam_checker, beam_checker_num_ancillas
 from circuit_parts.diffusers import diffuser, diffuser_gate
 from board_tools import board2_bitstrings
+from utils.asteroid_solver import asteroid_boards_min_beams
+from utils.execution import run_circuits, print_counts, decode_address
+from utils.ancilla import AncillaAllocator
 from datasets.data import *
 
 
@@ -51,13 +54,20 @@ def downsized(boards, num_iterations=1):
     return qc
 
 
-def week3_ans_func(boards, num_iterations=1):
+def week3_ans_func(boards, num_iterations=1, allocator=None, optimize=True):
+    if num_iterations is None:
+        from utils.grover_planner import plan_asteroid_iterations
+
+        num_iterations = plan_asteroid_iterations(boards)['iterations']
+
+    if allocator is None:
+        allocator = AncillaAllocator()
+
     board_qubits = QuantumRegister(16, name='board')
     address_qubits = QuantumRegister(4, name='address')
-    ancilla_qubits = QuantumRegister(7, name='ancilla')
     output_qubit = QuantumRegister(1, name='out')
     cbits = ClassicalRegister(4, name="cbits")
-    qc = QuantumCircuit(board_qubits, address_qubits, ancilla_qubits, output_qubit, cbits)
+    qc = QuantumCircuit(board_qubits, address_qubits, allocator.register, output_qubit, cbits)
 
     # Initialization
     # Flag to |->
@@ -67,52 +77,133 @@ def week3_ans_func(boards, num_iterations=1):
     # Address to |++++>
     qc.h(address_qubits)
 
-    write_qram(boards, qc, address_qubits, board_qubits, ancilla_qubits)
-    qc.barrier()
+    for _ in range(num_iterations):
+        with allocator.scope(qc, write_qram_num_ancillas(len(address_qubits), 'decoder'), "qRAM") as ancilla_qubits:
+            write_qram(boards, qc, address_qubits, board_qubits, ancilla_qubits, method='decoder')
+        qc.barrier()
 
-    beam_checker(qc, board_qubits, output_qubit, ancilla_qubits)
+        with allocator.scope(qc, beam_checker_num_ancillas(4), "beam_checker") as ancilla_qubits:
+            beam_checker(qc, board_qubits, output_qubit, ancilla_qubits)
 
-    qc.barrier()
+        qc.barrier()
 
-    write_qram(boards, qc, address_qubits, board_qubits, ancilla_qubits)
-    qc.barrier()
+        with allocator.scope(qc, write_qram_num_ancillas(len(address_qubits), 'decoder'),
+                             "qRAM uncompute") as ancilla_qubits:
+            write_qram(boards, qc, address_qubits, board_qubits, ancilla_qubits, method='decoder')
+        qc.barrier()
 
-    diffuser(qc, address_qubits)
+        diffuser(qc, address_qubits)
 
     qc.barrier()
     qc.measure(address_qubits, cbits)
 
     #qc = qc.reverse_bits()
 
+    qc = allocator.compact(qc)
+    if optimize:
+        from utils.peephole import optimize_circuit
+
+        qc, _ = optimize_circuit(qc)
+
     return qc
 
 
-def run_circuit(boards, qc_generator, draw=False):
+def week3_fixed_point_func(boards, phases, allocator=None, optimize=True):
+    # Fixed-point amplification over the addresses, phases as returned by
+    # utils.amplification.fixed_point_phases. The flag starts in |0>, every
+    # step computes the beam_checker bit into it, applies the oracle phase and
+    # uncomputes it.
+    if allocator is None:
+        allocator = AncillaAllocator()
+
+    board_qubits = QuantumRegister(16, name='board')
+    address_qubits = QuantumRegister(4, name='address')
+    output_qubit = QuantumRegister(1, name='out')
+    cbits = ClassicalRegister(4, name="cbits")
+    qc = QuantumCircuit(board_qubits, address_qubits, allocator.register, output_qubit, cbits)
+
+    # Address to |++++>
+    qc.h(address_qubits)
+
+    for oracle_phase, diffuser_phase in phases:
+        with allocator.scope(qc, write_qram_num_ancillas(len(address_qubits), 'decoder'), "qRAM") as ancilla_qubits:
+            write_qram(boards, qc, address_qubits, board_qubits, ancilla_qubits, method='decoder')
+        qc.barrier()
+
+        with allocator.scope(qc, beam_checker_num_ancillas(4), "beam_checker") as ancilla_qubits:
+            beam_checker(qc, board_qubits, output_qubit, ancilla_qubits)
+            qc.p(oracle_phase, output_qubit)
+            beam_checker(qc, board_qubits, output_qubit, ancilla_qubits)
+        qc.barrier()
+
+        with allocator.scope(qc, write_qram_num_ancillas(len(address_qubits), 'decoder'),
+                             "qRAM uncompute") as ancilla_qubits:
+            write_qram(boards, qc, address_qubits, board_qubits, ancilla_qubits, method='decoder')
+        qc.barrier()
+
+        diffuser(qc, address_qubits, phase=diffuser_phase)
+
+    qc.barrier()
+    qc.measure(address_qubits, cbits)
+
+    qc = allocator.compact(qc)
+    if optimize:
+        from utils.peephole import optimize_circuit
+
+        qc, _ = optimize_circuit(qc)
+
+    return qc
+
+
+def run_circuit(boards, qc_generator, draw=False, sparse=False):
     qc = qc_generator(boards)
 
     if draw:
         qc.draw(output='mpl')
         plt.show()
 
-    backend = Aer.get_backend('qasm_simulator')
-    job = execute(qc, backend, shots=1000)
-    result = job.result()
-    count = result.get_counts()
+    counts = run_circuits([qc], method='sparse' if sparse else 'aer')[0]
+    print_counts(counts, decode=True)
+
+
+def run_problem_bank(problem_sets, qc_generator, shots=1000, processes=None, sparse=False):
+    # Most likely board of every problem set, all circuits run as one batch
+    circuits = [qc_generator(board2_bitstrings(problems)) for problems in problem_sets]
+    results = run_circuits(circuits, shots=shots, method='sparse' if sparse else 'aer', processes=processes)
+
+    return [decode_address(counts[0][0]) for counts in results]
 
-    for k in sorted(count, key=count.get, reverse=True):
-        print(f"Solution: {k} (Board {int(''.join(reversed(k)), 2)})\tCounts: {count[k]}")
 
+def week3_stage_names(num_iterations=1):
+    # Barrier regions of week3_ans_func, from the second iteration on the
+    # diffuser shares its region with the next qRAM
+    names = ["init + qRAM", "beam_checker", "qRAM uncompute"]
+    for k in range(2, num_iterations + 1):
+        names += [f"diffuser + qRAM {k}", f"beam_checker {k}", f"qRAM uncompute {k}"]
 
-def compute_circuit_cost(boards, qc_generator, draw=False):
-    from utils.grader_utils import compute_cost
+    return names + ["diffuser", "measure"]
+
+
+def compute_circuit_cost(boards, qc_generator, draw=False, profile=False):
+    from utils.cost_model import compute_cost
 
     qc = qc_generator(boards)
     print(compute_cost(qc))
 
+    if profile:
+        from utils.cost_profiler import profile_circuit, format_profile
+
+        # Three barriers per iteration and one before the measurement
+        num_barriers = sum(inst.name == 'barrier' for inst, _, _ in qc.data)
+        stages = week3_stage_names((num_barriers - 1) // 3)
+        print(format_profile(profile_circuit(qc, stages), max_level=3))
+
 
 if __name__ == "__main__":
 
     #run_circuit(board2_bitstrings(problem_set3x3, board_size=3), lambda l: downsized(l, num_iterations=1))
 
-    compute_circuit_cost(board2_bitstrings(problem_set), lambda l: week3_ans_func(l, num_iterations=1))
+    print(f"Classical answer: {np.flatnonzero(asteroid_boards_min_beams(problem_set) > 3).tolist()}")
+
+    compute_circuit_cost(board2_bitstrings(problem_set), lambda l: week3_ans_func(l, num_iterations=1), profile=True)
     run_circuit(board2_bitstrings(problem_set), lambda l: week3_ans_func(l, num_iterations=1))